@@ -1,14 +1,28 @@
 from flask import Flask
 
 from .database.models import db
-from .database import config
+from .database import config, pool, repository
+from . import metrics
 
 
 def create_app():
     flask_app = Flask(__name__)
     flask_app.config['SQLALCHEMY_DATABASE_URI'] = config.DATABASE_CONNECTION_URI
     flask_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool.engine_options()
     flask_app.app_context().push()
     db.init_app(flask_app)
     db.create_all()
+    repository.create_missing_indexes(db.engine)
+    repository.create_table_versions(db.engine)
+    metrics.instrument_engine(db.engine)
+    metrics.instrument_app(flask_app)
+
+    # The app context pushed above outlives every request, so Flask-SQLAlchemy
+    # never removes the session on its own and each thread would keep its
+    # connection checked out between requests
+    @flask_app.teardown_request
+    def remove_session(exception=None):
+        db.session.remove()
+
     return flask_app
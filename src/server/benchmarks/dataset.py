@@ -0,0 +1,331 @@
+import argparse
+import os
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Synthetic NBA dataset
+# Same files and columns as the Kaggle dataset populate_database.py and the
+# feature notebook read: 30 teams, 15-man rosters, ~1230 games a season with
+# box scores whose team totals add up, and daily standings derived from them
+
+FIRST_TEAM_ID = 1610612737
+FIRST_PLAYER_ID = 200000
+LEAGUE_ID = 0
+TEAMS = 30
+ROSTER = 15
+ACTIVE = 13
+SEASON_DAYS = 175
+LAST_SEASON = 2019
+
+GAME_FEATURES = ["PTS", "FG_PCT", "FT_PCT", "FG3_PCT", "AST", "REB"]
+DETAIL_STATS = [
+    "FGM",
+    "FGA",
+    "FG_PCT",
+    "FG3M",
+    "FG3A",
+    "FG3_PCT",
+    "FTM",
+    "FTA",
+    "FT_PCT",
+    "OREB",
+    "DREB",
+    "REB",
+    "AST",
+    "STL",
+    "BLK",
+    "TO",
+    "PF",
+    "PTS",
+    "PLUS_MINUS",
+]
+START_POSITIONS = np.array(["F", "F", "C", "G", "G"] + [None] * (ACTIVE - 5))
+
+
+def _teams(first_season):
+    team_ids = FIRST_TEAM_ID + np.arange(TEAMS)
+    return pd.DataFrame(
+        {
+            "LEAGUE_ID": LEAGUE_ID,
+            "TEAM_ID": team_ids,
+            "MIN_YEAR": first_season - 20,
+            "MAX_YEAR": LAST_SEASON,
+            "ABBREVIATION": [f"T{i:02d}" for i in range(TEAMS)],
+            "NICKNAME": [f"Team {i}" for i in range(TEAMS)],
+            "YEARFOUNDED": first_season - 20,
+            "CITY": [f"City {i}" for i in range(TEAMS)],
+            "ARENA": [f"Arena {i}" for i in range(TEAMS)],
+            "ARENACAPACITY": 19000,
+            "OWNER": [f"Owner {i}" for i in range(TEAMS)],
+            "GENERALMANAGER": [f"Manager {i}" for i in range(TEAMS)],
+            "HEADCOACH": [f"Coach {i}" for i in range(TEAMS)],
+            "DLEAGUEAFFILIATION": [f"Affiliate {i}" for i in range(TEAMS)],
+        }
+    )
+
+
+def _schedule(rng, season):
+    # 4 to 10 games a day, every team at most once a day: ~82 games per team
+    opening = date(season, 10, 22)
+    days, homes, aways = [], [], []
+    for day in range(SEASON_DAYS):
+        teams = rng.permutation(TEAMS)[: 2 * rng.integers(4, 11)]
+        days += [day] * (len(teams) // 2)
+        homes += list(teams[::2])
+        aways += list(teams[1::2])
+    dates = [(opening + timedelta(days=day)).isoformat() for day in days]
+    return np.array(days), np.array(dates), np.array(homes), np.array(aways)
+
+
+def _box_scores(rng, games):
+    # Shape (games, 2 sides, ACTIVE players)
+    shape = (games, 2, ACTIVE)
+    minutes = rng.integers(5, 33, shape)
+    fga = rng.binomial(minutes, 0.37)
+    fg3a = rng.binomial(fga, 0.35)
+    fg3m = rng.binomial(fg3a, 0.36)
+    fgm = fg3m + rng.binomial(fga - fg3a, 0.5)
+    fta = rng.binomial(minutes, 0.1)
+    ftm = rng.binomial(fta, 0.77)
+    oreb = rng.binomial(minutes, 0.04)
+    dreb = rng.binomial(minutes, 0.14)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {
+            "MIN": minutes,
+            "FGM": fgm,
+            "FGA": fga,
+            "FG_PCT": np.round(fgm / fga, 3),
+            "FG3M": fg3m,
+            "FG3A": fg3a,
+            "FG3_PCT": np.round(fg3m / fg3a, 3),
+            "FTM": ftm,
+            "FTA": fta,
+            "FT_PCT": np.round(ftm / fta, 3),
+            "OREB": oreb,
+            "DREB": dreb,
+            "REB": oreb + dreb,
+            "AST": rng.binomial(minutes, 0.1),
+            "STL": rng.binomial(minutes, 0.03),
+            "BLK": rng.binomial(minutes, 0.02),
+            "TO": rng.binomial(minutes, 0.06),
+            "PF": rng.binomial(minutes, 0.08),
+            "PTS": 2 * fgm + fg3m + ftm,
+        }
+
+
+def _team_totals(box):
+    totals = {stat: box[stat].sum(axis=2) for stat in ["PTS", "AST", "REB"]}
+    for pct, made, attempts in [
+        ("FG_PCT", "FGM", "FGA"),
+        ("FT_PCT", "FTM", "FTA"),
+        ("FG3_PCT", "FG3M", "FG3A"),
+    ]:
+        totals[pct] = np.round(
+            box[made].sum(axis=2) / np.maximum(box[attempts].sum(axis=2), 1), 3
+        )
+    return totals
+
+
+def _standings(season, days, homes, aways, home_wins, teams):
+    # Every team's record on every day of the season, counting the games played
+    # before that day
+    won = np.zeros((SEASON_DAYS, TEAMS, 2), dtype=np.int64)
+    lost = np.zeros((SEASON_DAYS, TEAMS, 2), dtype=np.int64)
+    np.add.at(won, (days, homes, 0), home_wins)
+    np.add.at(lost, (days, homes, 0), 1 - home_wins)
+    np.add.at(won, (days, aways, 1), 1 - home_wins)
+    np.add.at(lost, (days, aways, 1), home_wins)
+    won = np.cumsum(won, axis=0) - won
+    lost = np.cumsum(lost, axis=0) - lost
+
+    w = won.sum(axis=2).ravel()
+    l = lost.sum(axis=2).ravel()
+    home = won[:, :, 0].ravel().astype(str), lost[:, :, 0].ravel().astype(str)
+    road = won[:, :, 1].ravel().astype(str), lost[:, :, 1].ravel().astype(str)
+    opening = date(season, 10, 22)
+    dates = [(opening + timedelta(days=day)).isoformat() for day in range(SEASON_DAYS)]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        w_pct = np.where(w + l > 0, np.round(w / (w + l), 3), 0.0)
+    return pd.DataFrame(
+        {
+            "TEAM_ID": np.tile(teams["TEAM_ID"].values, SEASON_DAYS),
+            "LEAGUE_ID": LEAGUE_ID,
+            "SEASON_ID": f"2{season}",
+            "STANDINGSDATE": np.repeat(dates, TEAMS),
+            "CONFERENCE": np.tile(np.repeat(["East", "West"], TEAMS // 2), SEASON_DAYS),
+            "TEAM": np.tile(teams["CITY"].values, SEASON_DAYS),
+            "G": w + l,
+            "W": w,
+            "L": l,
+            "W_PCT": w_pct,
+            "HOME_RECORD": np.char.add(np.char.add(home[0], "-"), home[1]),
+            "ROAD_RECORD": np.char.add(np.char.add(road[0], "-"), road[1]),
+            "RETURNTOPLAY": np.nan,
+        }
+    )
+
+
+def _season(rng, season, teams, rosters):
+    days, dates, homes, aways = _schedule(rng, season)
+    n = len(days)
+    box = _box_scores(rng, n)
+    totals = _team_totals(box)
+    # Ties are broken in overtime, by the home team
+    box["PTS"][:, 0, 0] += totals["PTS"][:, 0] == totals["PTS"][:, 1]
+    totals["PTS"] = box["PTS"].sum(axis=2)
+    home_wins = (totals["PTS"][:, 0] > totals["PTS"][:, 1]).astype(np.int64)
+
+    team_ids = teams["TEAM_ID"].values
+    game_ids = np.array([int(f"2{season}{i + 1:05d}") for i in range(n)])
+    games = {
+        "GAME_DATE_EST": dates,
+        "GAME_ID": game_ids,
+        "GAME_STATUS_TEXT": "Final",
+        "HOME_TEAM_ID": team_ids[homes],
+        "VISITOR_TEAM_ID": team_ids[aways],
+        "SEASON": season,
+    }
+    for side, s, team in [("home", 0, homes), ("away", 1, aways)]:
+        games[f"TEAM_ID_{side}"] = team_ids[team]
+        games.update({f"{col}_{side}": totals[col][:, s] for col in GAME_FEATURES})
+    games["HOME_TEAM_WINS"] = home_wins
+
+    # 13 of every team's 15 players play each game, the first five start
+    sides = np.stack([homes, aways], axis=1)
+    picks = rng.random((n, 2, ROSTER)).argsort(axis=2)[:, :, :ACTIVE]
+    players = rosters[sides[:, :, None], picks]
+    margin = totals["PTS"] - totals["PTS"][:, ::-1]
+    box["PLUS_MINUS"] = np.broadcast_to(margin[:, :, None], players.shape)
+    details = {
+        "GAME_ID": np.repeat(game_ids, 2 * ACTIVE),
+        "TEAM_ID": team_ids[np.repeat(sides.ravel(), ACTIVE)],
+        "TEAM_ABBREVIATION": teams["ABBREVIATION"].values[
+            np.repeat(sides.ravel(), ACTIVE)
+        ],
+        "TEAM_CITY": teams["CITY"].values[np.repeat(sides.ravel(), ACTIVE)],
+        "PLAYER_ID": players.ravel(),
+        "PLAYER_NAME": [f"Player {p}" for p in players.ravel()],
+        "START_POSITION": np.tile(START_POSITIONS, 2 * n),
+        "COMMENT": None,
+        "MIN": [f"{m}:00" for m in box["MIN"].ravel()],
+    }
+    details.update({stat: box[stat].ravel() for stat in DETAIL_STATS})
+
+    rankings = _standings(season, days, homes, aways, home_wins, teams)
+    return pd.DataFrame(games), pd.DataFrame(details), rankings
+
+
+def generate_dataset(out, seasons=1, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(out, exist_ok=True)
+    first_season = LAST_SEASON - seasons + 1
+    teams = _teams(first_season)
+    pd.DataFrame({"LEAGUE_ID": [LEAGUE_ID]}).to_csv(f"{out}/leagues.csv", index=False)
+    teams.to_csv(f"{out}/teams.csv", index=False)
+
+    rosters = FIRST_PLAYER_ID + np.arange(TEAMS * ROSTER).reshape(TEAMS, ROSTER)
+    next_player = FIRST_PLAYER_ID + TEAMS * ROSTER
+    rows = {"games": 0, "games_details": 0, "rankings": 0, "players_teams": 0}
+    for season in range(first_season, LAST_SEASON + 1):
+        # Three players of every team are replaced between seasons
+        if season > first_season:
+            replaced = rng.random((TEAMS, ROSTER)).argsort(axis=1)[:, :3]
+            new_players = next_player + np.arange(TEAMS * 3).reshape(TEAMS, 3)
+            np.put_along_axis(rosters, replaced, new_players, axis=1)
+            next_player += TEAMS * 3
+
+        games, details, rankings = _season(rng, season, teams, rosters)
+        players = pd.DataFrame(
+            {
+                "PLAYER_NAME": [f"Player {p}" for p in rosters.ravel()],
+                "TEAM_ID": np.repeat(teams["TEAM_ID"].values, ROSTER),
+                "PLAYER_ID": rosters.ravel(),
+                "SEASON": season,
+            }
+        )
+
+        header = season == first_season
+        for name, df, entity in [
+            ("games", games, "games"),
+            ("games_details", details, "games_details"),
+            ("ranking", rankings, "rankings"),
+            ("players", players, "players_teams"),
+        ]:
+            df.to_csv(
+                f"{out}/{name}.csv",
+                mode="w" if header else "a",
+                header=header,
+                index=False,
+            )
+            rows[entity] += len(df)
+        print(f" * Season {season}: {len(games)} games")
+    return rows
+
+
+# The model dataset, formatted like eda/nba_features_extraction.ipynb does
+
+
+def _record_pct(records):
+    won_lost = records.str.split("-", expand=True).astype(int)
+    total = won_lost[0] + won_lost[1]
+    return (won_lost[0] / total).where(total > 0)
+
+
+def format_dataset(dataset_dir, out):
+    os.makedirs(out, exist_ok=True)
+
+    rankings = pd.read_csv(
+        f"{dataset_dir}/ranking.csv",
+        dtype={"HOME_RECORD": str, "ROAD_RECORD": str, "SEASON_ID": str},
+    )
+    rankings["HOME_RECORD"] = _record_pct(rankings["HOME_RECORD"])
+    rankings["ROAD_RECORD"] = _record_pct(rankings["ROAD_RECORD"])
+    rankings["SEASON_ID"] = rankings["SEASON_ID"].str[1:5]
+    rankings = rankings[
+        [
+            "TEAM_ID",
+            "SEASON_ID",
+            "STANDINGSDATE",
+            "G",
+            "W",
+            "L",
+            "W_PCT",
+            "HOME_RECORD",
+            "ROAD_RECORD",
+        ]
+    ].dropna()
+    rankings.to_csv(f"{out}/formated_rankings.csv", index=False)
+
+    columns = ["GAME_DATE_EST", "GAME_ID", "SEASON"]
+    for side in ["home", "away"]:
+        columns += [f"TEAM_ID_{side}"] + [f"{col}_{side}" for col in GAME_FEATURES]
+    columns.append("HOME_TEAM_WINS")
+    games = pd.read_csv(f"{dataset_dir}/games.csv")
+    games = games.sort_values(by="GAME_DATE_EST").dropna()
+    games[columns].to_csv(f"{out}/formated_games.csv", index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic NBA dataset")
+    parser.add_argument("--out", default="./data/benchmarks/nba_dataset")
+    parser.add_argument(
+        "--seasons",
+        type=int,
+        default=1,
+        help="Seasons to generate, ~1230 games and ~32000 box score rows each",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--model-dataset",
+        default=None,
+        help="Also write formated_games.csv and formated_rankings.csv here",
+    )
+    args = parser.parse_args()
+
+    rows = generate_dataset(args.out, args.seasons, args.seed)
+    print(f" * Saved {rows} to {args.out}")
+    if args.model_dataset is not None:
+        format_dataset(args.out, args.model_dataset)
+        print(f" * Saved the model dataset to {args.model_dataset}")
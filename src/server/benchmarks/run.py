@@ -0,0 +1,390 @@
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+import joblib
+import pandas as pd
+from sklearn.tree import DecisionTreeClassifier
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+from ..database import config
+from ..database.models import ENTITY_MAPPER
+from ..prediction_models.feature_index import TeamGamesIndex, TeamRankingsIndex
+from ..prediction_models.prepare_data import (
+    game_features,
+    get_vector_data,
+    get_vector_data_batch,
+    ranking_features,
+)
+from ..prediction_models.training_set import build_training_set
+from .dataset import format_dataset, generate_dataset
+from .timing import measure, timed, timings
+from .tree_inference import bench_tree_inference
+
+# Benchmarks
+# Every run works in its own directory laid out like the repository root, so
+# the server finds the generated CSVs and model at the paths it always uses,
+# and a sqlite file stands in for MySQL
+
+MODEL_PATH = "models/nba_sklearn_model_extended.pkl"
+GAMES_PATH = "data/model_dataset/formated_games.csv"
+RANKINGS_PATH = "data/model_dataset/formated_rankings.csv"
+TRAINING_SET_PATH = "data/model_dataset/extended_games_formated.csv"
+DATASET_DIR = "data/nba_dataset"
+DATABASE_PATH = "benchmark.sqlite"
+LOADER_DATABASE_PATH = "loader.sqlite"
+# populate_database.py is a script run from here, importing database.* as a
+# top-level package
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded in foreign key order
+INGESTED = [
+    ("leagues", "leagues.csv"),
+    ("teams", "teams.csv"),
+    ("players", "players.csv"),
+    ("players_teams", "players.csv"),
+    ("games", "games.csv"),
+    ("games_details", "games_details.csv"),
+    ("rankings", "ranking.csv"),
+]
+
+# The first season has no previous season of standings, so its games have no
+# features and at least one more season is needed to train on
+MIN_SEASONS = 2
+
+# Settings the server reads at import, recorded with the results
+SETTINGS_PREFIXES = ("PREDICTION_", "DATABASE_POOL_")
+
+
+def _yearweek(value):
+    # MySQL's YEARWEEK(date), weeks from Sunday to Saturday
+    day = datetime.fromisoformat(str(value)[:19])
+    sunday = day - timedelta(days=(day.weekday() + 1) % 7)
+    return sunday.year * 100 + int(sunday.strftime("%U"))
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_functions(connection, record):
+    if isinstance(connection, sqlite3.Connection):
+        connection.create_function("YEARWEEK", 1, _yearweek)
+
+
+def prepare(seasons, seed, workers):
+    if seasons < MIN_SEASONS:
+        raise ValueError(f"The benchmark needs at least {MIN_SEASONS} seasons")
+
+    setup = {}
+    if not os.path.exists(f"{DATASET_DIR}/games.csv"):
+        _, setup["generate_s"] = timed(generate_dataset, DATASET_DIR, seasons, seed)
+        _, setup["format_s"] = timed(
+            format_dataset, DATASET_DIR, os.path.dirname(GAMES_PATH)
+        )
+
+    if not os.path.exists(MODEL_PATH):
+        _, setup["training_set_s"] = timed(
+            build_training_set, GAMES_PATH, RANKINGS_PATH, TRAINING_SET_PATH, workers
+        )
+
+        # Same model as eda/nba_sklearn_model_extended.ipynb, on the columns
+        # get_vector_data gives /match
+        vectors = pd.read_csv(TRAINING_SET_PATH).dropna()
+        features = vectors.drop(columns=["GAME_ID", "HOME_TEAM_WINS"])
+        model = DecisionTreeClassifier(max_depth=5)
+        _, setup["train_s"] = timed(
+            model.fit, features.values, vectors["HOME_TEAM_WINS"].values
+        )
+        os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+        joblib.dump(model, MODEL_PATH)
+    return {step: round(seconds, 3) for step, seconds in setup.items()}
+
+
+def _sample_games(count, seed):
+    # Games of the last season, which all have a previous season of history
+    games = pd.read_csv(GAMES_PATH)
+    games = games.loc[games["SEASON"] == games["SEASON"].max()]
+    games = games.sample(min(count, len(games)), random_state=seed)
+    return games[["GAME_ID", "GAME_DATE_EST", "TEAM_ID_home", "TEAM_ID_away"]]
+
+
+def bench_features(games, repeat):
+    all_games = pd.read_csv(GAMES_PATH)
+    all_rankings = pd.read_csv(RANKINGS_PATH)
+    games_index, rankings_index = None, None
+
+    def _build_indexes(_):
+        nonlocal games_index, rankings_index
+        games_index = TeamGamesIndex(all_games, game_features)
+        rankings_index = TeamRankingsIndex(all_rankings, ranking_features)
+
+    results = {"index_build": measure(_build_indexes, repeat, rows=len(all_games))}
+    results["vector_batch"] = measure(
+        lambda _: get_vector_data_batch(games, games_index, rankings_index),
+        repeat,
+        rows=len(games),
+    )
+    results["vector_single"] = measure(
+        lambda i: get_vector_data(
+            games.iloc[[i % len(games)]],
+            all_games=None,
+            all_rankings=None,
+            games_index=games_index,
+            rankings_index=rankings_index,
+        ),
+        repeat,
+        rows=1,
+    )
+    return results
+
+
+def bench_prediction(api, client, games, repeat, batch_size):
+    batch = games.iloc[:batch_size].to_dict("records")
+    results = {"warmup": api.warmup()}
+
+    # /match takes one game as single-item columns, and answers 400 for games
+    # without enough history
+    predictable = [p is not None for p in api.score_games(games)]
+    games_json = [
+        {k: [v] for k, v in game.items()}
+        for game in games.loc[predictable].to_dict("records")
+    ]
+    results["score_games"] = measure(
+        lambda _: api.score_games(games), repeat, rows=len(games)
+    )
+
+    # Every run asks for another game, so none is answered from the cache
+    api.PREDICTION_CACHE.clear()
+    results["match"] = measure(
+        lambda i: _post(client, "/match", games_json[i % len(games_json)]), repeat
+    )
+    results["match_cached"] = measure(
+        lambda _: _post(client, "/match", games_json[0]), repeat
+    )
+    results["match_batch"] = measure(
+        lambda _: _post(client, "/match/batch", batch), repeat, rows=len(batch)
+    )
+    return results
+
+
+def _read_records(entity, file, limit):
+    model = ENTITY_MAPPER[entity]
+    dtypes = model.csv_dtypes()
+    keys = [column.name for column in model.__table__.primary_key.columns]
+    df = pd.read_csv(
+        f"{DATASET_DIR}/{file}", usecols=list(dtypes), dtype=dtypes, nrows=limit
+    )
+    # players.csv lists every player once per season
+    return model.frame_mapper(df).drop_duplicates(subset=keys).to_dict("records")
+
+
+def bench_ingestion(client, rows, chunk_size):
+    results = {}
+    for entity, file in INGESTED:
+        records, parse_s = timed(_read_records, entity, file, rows)
+
+        seconds = []
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start : start + chunk_size]
+            _, elapsed = timed(_post, client, f"/add/{entity}/bulk", chunk)
+            seconds.append(elapsed)
+
+        results[entity] = {
+            "parse_s": round(parse_s, 3),
+            "parse_rows_per_s": round(len(records) / max(parse_s, 1e-9), 1),
+            "chunks": timings(seconds),
+            "rows": len(records),
+            "rows_per_s": round(len(records) / max(sum(seconds), 1e-9), 1),
+        }
+    return results
+
+
+def bench_loader(rows, chunk_size):
+    # The CSV-streaming upsert loader of populate_database.py --bulk, table by
+    # table into its own sqlite file
+    if SERVER_DIR not in sys.path:
+        sys.path.insert(0, SERVER_DIR)
+    loader = importlib.import_module("populate_database")
+
+    if not os.path.exists(f"{DATASET_DIR}/cleaned_players.csv"):
+        loader.extract_players(dataset_dir=DATASET_DIR, to=DATASET_DIR)
+    if os.path.exists(LOADER_DATABASE_PATH):
+        os.remove(LOADER_DATABASE_PATH)
+    engine = create_engine(f"sqlite:///{os.path.abspath(LOADER_DATABASE_PATH)}")
+    loader.db.Model.metadata.create_all(engine)
+    loader.create_table_versions(engine)
+
+    results = {}
+    dependencies = loader.table_dependencies(list(loader.TABLES))
+    for entity in loader.dependency_order(dependencies):
+        inserted, seconds = timed(
+            loader.bulk_populate_table,
+            engine,
+            data_dir=f"{DATASET_DIR}/{loader.TABLES[entity]}",
+            entity=entity,
+            limit=rows,
+            chunk_size=chunk_size,
+        )
+        results[entity] = {
+            "seconds": round(seconds, 3),
+            "rows": inserted,
+            "rows_per_s": round(inserted / max(seconds, 1e-9), 1),
+        }
+    _, seconds = timed(loader.rebuild_weekly_player_totals, engine)
+    results["rebuild_weekly_player_totals_s"] = round(seconds, 3)
+    return results
+
+
+def bench_queries(client, repeat, rows):
+    # Dates and seasons of the games loaded by bench_ingestion
+    games = pd.read_csv(
+        f"{DATASET_DIR}/games.csv", usecols=["GAME_DATE_EST", "SEASON"], nrows=rows
+    )
+    top_ten = {"limit": 10}
+    dates = games["GAME_DATE_EST"].drop_duplicates().tolist()
+    seasons = games["SEASON"].drop_duplicates().tolist()
+    return {
+        "players_week": measure(
+            lambda i: _get(client, f"/players/week/{dates[i % len(dates)]}", top_ten),
+            repeat,
+        ),
+        "players_season": measure(
+            lambda i: _get(
+                client, f"/players/season/{seasons[i % len(seasons)]}", top_ten
+            ),
+            repeat,
+        ),
+        "games_page": measure(
+            lambda _: _get(client, "/games?limit=1000"), repeat, rows=1000
+        ),
+        "games_details_page": measure(
+            lambda _: _get(client, "/games_details?limit=1000"), repeat, rows=1000
+        ),
+    }
+
+
+def _post(client, url, payload):
+    response = client.post(url, json=payload)
+    if response.status_code != 200:
+        raise RuntimeError(f"POST {url}: {response.status_code} {response.data}")
+    return response
+
+
+def _get(client, url, payload=None):
+    response = client.get(url, json=payload)
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {url}: {response.status_code} {response.data}")
+    return response
+
+
+def run(
+    workdir,
+    seasons=MIN_SEASONS,
+    seed=0,
+    repeat=20,
+    batch_size=100,
+    ingest_rows=20000,
+    chunk_size=1000,
+    workers=None,
+):
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    setup = prepare(seasons, seed, workers)
+
+    if os.path.exists(DATABASE_PATH):
+        os.remove(DATABASE_PATH)
+    config.DATABASE_CONNECTION_URI = f"sqlite:///{os.path.abspath(DATABASE_PATH)}"
+
+    # Imported last: the app connects to the database and reads its settings
+    # at import
+    from .. import server as api
+
+    client = api.app.test_client()
+    games = _sample_games(max(batch_size, repeat), seed)
+
+    results = {
+        "seasons": seasons,
+        "seed": seed,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": {
+                name: value
+                for name, value in os.environ.items()
+                if name.startswith(SETTINGS_PREFIXES)
+            },
+        },
+        "setup": setup,
+    }
+    results["features"] = bench_features(games, repeat)
+    results["prediction"] = bench_prediction(api, client, games, repeat, batch_size)
+    results["tree_inference"] = bench_tree_inference(
+        MODEL_PATH, TRAINING_SET_PATH, repeat, batch_size, seed
+    )
+    results["ingestion"] = bench_ingestion(client, ingest_rows, chunk_size)
+    results["loader"] = bench_loader(ingest_rows, chunk_size)
+    results["queries"] = bench_queries(client, repeat, ingest_rows)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark features, predictions, ingestion and queries "
+        "on a synthetic dataset"
+    )
+    parser.add_argument(
+        "--seasons",
+        type=int,
+        default=MIN_SEASONS,
+        help="Dataset size: 2, 10 or 100 seasons for the 1x, 10x and 100x runs",
+    )
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        help="Where the dataset, model and database are kept between runs "
+        "(default: ./data/benchmarks/SEASONS_seasons)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--ingest-rows", type=int, default=20000, help="Rows loaded per table"
+    )
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes building the training set (default: one per core)",
+    )
+    parser.add_argument("--out", default=None, help="Also write the results here")
+    args = parser.parse_args()
+    if args.seasons < MIN_SEASONS:
+        parser.error(f"--seasons must be at least {MIN_SEASONS}")
+
+    workdir = args.workdir or f"./data/benchmarks/{args.seasons}_seasons"
+    out = os.path.abspath(args.out) if args.out else None
+    # Progress goes to stderr, stdout only gets the results
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(
+            os.path.abspath(workdir),
+            seasons=args.seasons,
+            seed=args.seed,
+            repeat=args.repeat,
+            batch_size=args.batch_size,
+            ingest_rows=args.ingest_rows,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+        )
+
+    output = json.dumps(results, indent=2, default=float)
+    if out is not None:
+        with open(out, "w") as f:
+            f.write(output)
+    print(output)
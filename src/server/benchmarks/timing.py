@@ -0,0 +1,34 @@
+import time
+
+import numpy as np
+
+
+def timings(seconds, rows=None):
+    ms = np.array(seconds) * 1000
+    result = {
+        "runs": len(ms),
+        "mean_ms": round(ms.mean(), 3),
+        "p50_ms": round(np.percentile(ms, 50), 3),
+        "p95_ms": round(np.percentile(ms, 95), 3),
+        "min_ms": round(ms.min(), 3),
+        "max_ms": round(ms.max(), 3),
+    }
+    if rows is not None:
+        result["rows"] = rows
+        result["rows_per_s"] = round(rows * len(ms) / sum(seconds), 1)
+    return result
+
+
+def measure(function, repeat, rows=None):
+    seconds = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(i)
+        seconds.append(time.perf_counter() - start)
+    return timings(seconds, rows)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
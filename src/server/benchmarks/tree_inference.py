@@ -0,0 +1,179 @@
+import argparse
+import json
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from ..prediction_models.compiled_trees import CompiledTrees
+from .timing import measure, timed
+
+# Compiled tree models against the sklearn estimators they come from. The
+# predictions must be the same, bit for bit, on the training rows, on rows
+# placed exactly on and next to every split threshold, and on random rows.
+# Both are then timed on single rows, the /match case, and on batches
+
+MODEL_PATH = "models/nba_sklearn_model_extended.pkl"
+TRAINING_SET_PATH = "data/model_dataset/extended_games_formated.csv"
+
+# Fitted on the same rows to cover the other shapes the compiler handles:
+# a deep single tree, an averaged classifier and an averaged regressor
+REFERENCE_MODELS = {
+    "deep_tree": lambda seed: DecisionTreeClassifier(random_state=seed),
+    "random_forest": lambda seed: RandomForestClassifier(
+        n_estimators=100, max_depth=10, random_state=seed
+    ),
+    "extra_trees_regressor": lambda seed: ExtraTreesRegressor(
+        n_estimators=50, max_depth=12, random_state=seed
+    ),
+}
+
+SINGLE_ROW_CHECKS = 200
+
+
+def _training_rows(path):
+    vectors = pd.read_csv(path).dropna()
+    features = vectors.drop(columns=["GAME_ID", "HOME_TEAM_WINS"])
+    return features.values, vectors["HOME_TEAM_WINS"].values
+
+
+def parity_rows(compiled, X, seed):
+    rng = np.random.default_rng(seed)
+
+    # Every split once, with its feature on the threshold as sklearn's float32
+    # cast sees it, and one float32 step to each side
+    splits = np.flatnonzero(compiled.left != np.arange(compiled.n_nodes))
+    features = compiled.feature[splits]
+    on = np.asarray(compiled.threshold[splits], dtype=np.float32)
+    edges = []
+    for values in (
+        on,
+        np.nextafter(on, np.float32(np.inf)),
+        np.nextafter(on, np.float32(-np.inf)),
+    ):
+        rows = X[rng.integers(len(X), size=len(splits))].astype(np.float32)
+        rows[np.arange(len(splits)), features] = values
+        edges.append(rows)
+
+    low, high = X.min(axis=0), X.max(axis=0)
+    random = rng.uniform(low, high, size=(len(X), X.shape[1]))
+    return np.vstack([X.astype(np.float32), *edges, random.astype(np.float32)])
+
+
+def check_parity(estimator, compiled, X, seed):
+    classifier = compiled.classes is not None
+    result = {
+        "rows": len(X),
+        "predict": bool(np.array_equal(estimator.predict(X), compiled.predict(X))),
+    }
+    if classifier:
+        result["predict_proba"] = bool(
+            np.array_equal(estimator.predict_proba(X), compiled.predict_proba(X))
+        )
+
+    rows = np.random.default_rng(seed).integers(len(X), size=SINGLE_ROW_CHECKS)
+    result["single_rows"] = all(
+        np.array_equal(estimator.predict(X[[i]]), compiled.predict(X[[i]]))
+        for i in rows
+    )
+
+    # Only estimators fitted by an sklearn that routes missing values take NaN
+    missing = X.copy()
+    missing[np.random.default_rng(seed).random(X.shape) < 0.1] = np.nan
+    try:
+        expected = estimator.predict(missing)
+    except ValueError:
+        result["missing_values"] = None
+    else:
+        result["missing_values"] = bool(
+            np.array_equal(expected, compiled.predict(missing))
+        )
+    return result
+
+
+def bench_inference(estimator, compiled, X, repeat, batch_size):
+    batch = X[:batch_size]
+    results = {
+        "sklearn_single": measure(
+            lambda i: estimator.predict(X[[i % len(X)]]), repeat, rows=1
+        ),
+        "compiled_single": measure(
+            lambda i: compiled.predict(X[[i % len(X)]]), repeat, rows=1
+        ),
+        "sklearn_batch": measure(
+            lambda _: estimator.predict(batch), repeat, rows=len(batch)
+        ),
+        "compiled_batch": measure(
+            lambda _: compiled.predict(batch), repeat, rows=len(batch)
+        ),
+    }
+    for size in ("single", "batch"):
+        results[f"{size}_speedup"] = round(
+            results[f"sklearn_{size}"]["mean_ms"]
+            / max(results[f"compiled_{size}"]["mean_ms"], 1e-9),
+            2,
+        )
+    return results
+
+
+def bench_estimator(estimator, X, repeat, batch_size, seed):
+    compiled, compile_s = timed(CompiledTrees.from_estimator, estimator)
+    return {
+        "estimator": type(estimator).__name__,
+        "trees": compiled.n_trees,
+        "nodes": compiled.n_nodes,
+        "depth": compiled.depth,
+        "compile_s": round(compile_s, 4),
+        "parity": check_parity(
+            estimator, compiled, parity_rows(compiled, X, seed), seed
+        ),
+        "timings": bench_inference(estimator, compiled, X, repeat, batch_size),
+    }
+
+
+def bench_tree_inference(
+    model_path=MODEL_PATH,
+    training_set_path=TRAINING_SET_PATH,
+    repeat=200,
+    batch_size=1000,
+    seed=0,
+):
+    X, y = _training_rows(training_set_path)
+    results = {
+        "model": bench_estimator(joblib.load(model_path), X, repeat, batch_size, seed)
+    }
+    for name, make in REFERENCE_MODELS.items():
+        estimator = make(seed).fit(X, y)
+        results[name] = bench_estimator(estimator, X, repeat, batch_size, seed)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check compiled tree models against sklearn and time both"
+    )
+    parser.add_argument("--model", default=f"./{MODEL_PATH}")
+    parser.add_argument("--training-set", default=f"./{TRAINING_SET_PATH}")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Also write the results here")
+    args = parser.parse_args()
+
+    results = bench_tree_inference(
+        args.model, args.training_set, args.repeat, args.batch_size, args.seed
+    )
+
+    output = json.dumps(results, indent=2, default=float)
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            f.write(output)
+    print(output)
+
+    failed = [
+        name for name, result in results.items() if False in result["parity"].values()
+    ]
+    if failed:
+        raise SystemExit(f"Compiled predictions differ from sklearn: {failed}")
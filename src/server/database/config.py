@@ -1,10 +1,36 @@
 import os
 
-user = os.environ["MYSQL_USER"]
-password = os.environ["MYSQL_PASSWORD"]
-host = os.environ["MYSQL_HOST"]
-database = os.environ["MYSQL_DATABASE"]
-port = os.environ["MYSQL_PORT"]
 
-DATABASE_CONNECTION_URI = f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
+def _connection_uri():
+    # DATABASE_URI points the server at any other database, like the sqlite
+    # file the benchmarks run against
+    if "DATABASE_URI" in os.environ:
+        return os.environ["DATABASE_URI"]
 
+    user = os.environ["MYSQL_USER"]
+    password = os.environ["MYSQL_PASSWORD"]
+    host = os.environ["MYSQL_HOST"]
+    database = os.environ["MYSQL_DATABASE"]
+    port = os.environ["MYSQL_PORT"]
+
+    return f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
+
+
+def __getattr__(name):
+    # Read when something connects, so offline tools importing the package,
+    # like the feature store, training set and model builds, need no database
+    # settings. Assigning DATABASE_CONNECTION_URI overrides it
+    if name == "DATABASE_CONNECTION_URI":
+        return _connection_uri()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Connection pool, sized per server process: every worker thread holds at most
+# one connection, for its request session, while it is serving a request
+POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 10))
+POOL_MAX_OVERFLOW = int(os.environ.get("DATABASE_POOL_MAX_OVERFLOW", 5))
+POOL_TIMEOUT = float(os.environ.get("DATABASE_POOL_TIMEOUT", 30))
+# Below MySQL's wait_timeout, so idle connections are replaced before the
+# server drops them
+POOL_RECYCLE = int(os.environ.get("DATABASE_POOL_RECYCLE", 3600))
+POOL_PRE_PING = os.environ.get("DATABASE_POOL_PRE_PING", "1") == "1"
@@ -1,28 +1,97 @@
 import flask_sqlalchemy
 import numpy as np
+import pandas as pd
 
 db = flask_sqlalchemy.SQLAlchemy()
 
+# CSV COLUMN CONVERTERS
+# Every converter takes a whole CSV column and returns an object column with
+# native python values and None in place of NaN
 
-class PlayersTeams(db.Model):
+
+def _with_nulls(values, converted):
+    return pd.Series(
+        np.where(values.isna(), None, converted), index=values.index, dtype=object
+    )
+
+
+def to_str(values):
+    return _with_nulls(values, np.asarray(values.astype(str), dtype=object))
+
+
+def to_id(values):
+    if pd.api.types.is_float_dtype(values):
+        values = values.astype("Int64")
+    return to_str(values)
+
+
+def to_int(values):
+    values = pd.to_numeric(values, errors="coerce")
+    return _with_nulls(values, values.fillna(0).astype(np.int64).values.astype(object))
+
+
+def to_float(values):
+    values = pd.to_numeric(values, errors="coerce")
+    return _with_nulls(values, values.values.astype(object))
+
+
+# dtypes to read each converter's CSV column with, so no per-cell type sniffing
+CONVERTER_DTYPES = {
+    to_str: str,
+    to_id: str,
+    to_int: "float64",
+    to_float: "float64",
+}
+
+
+class JsonMapped:
+    json_columns = []
+
+    def to_json(self):
+        return {column: getattr(self, column) for column in self.json_columns}
+
+
+class CsvMapped:
+    csv_columns = {}
+
+    @classmethod
+    def csv_dtypes(cls):
+        return {
+            csv_column: CONVERTER_DTYPES[converter]
+            for csv_column, converter in cls.csv_columns.values()
+        }
+
+    @classmethod
+    def frame_mapper(cls, df):
+        return pd.DataFrame(
+            {
+                attr: converter(df[csv_column])
+                for attr, (csv_column, converter) in cls.csv_columns.items()
+            }
+        )
+
+    @classmethod
+    def mapper(cls, csv_data):
+        return cls.frame_mapper(pd.DataFrame([csv_data])).to_dict("records")[0]
+
+
+class PlayersTeams(JsonMapped, CsvMapped, db.Model):
     __tablename__ = "players_teams"
 
     player_id = db.Column(db.String(20), db.ForeignKey("player.id"), primary_key=True)
     team_id = db.Column(db.String(20), db.ForeignKey("team.id"), primary_key=True)
     season = db.Column(db.Integer, primary_key=True)
 
-    @staticmethod
-    def mapper(csv_data):
-        return {
-            "team_id": str(csv_data["TEAM_ID"]) if csv_data["TEAM_ID"] else None,
-            "player_id": str(csv_data["PLAYER_ID"]) if csv_data["PLAYER_ID"] else None,
-            "season": int(csv_data["SEASON"])
-            if not np.isnan(csv_data["SEASON"])
-            else None,
-        }
+    json_columns = ["player_id", "team_id", "season"]
+
+    csv_columns = {
+        "team_id": ("TEAM_ID", to_id),
+        "player_id": ("PLAYER_ID", to_id),
+        "season": ("SEASON", to_int),
+    }
 
 
-class League(db.Model):
+class League(JsonMapped, CsvMapped, db.Model):
     __tablename__ = "league"
 
     id = db.Column(db.String(20), primary_key=True)
@@ -33,17 +102,14 @@ class League(db.Model):
     def __repr__(self):
         return f"<League {self.id}>"
 
-    def to_json(self, expand=False):
-        return {
-            "id": self.id,
-        }
+    json_columns = ["id"]
 
-    @staticmethod
-    def mapper(csv_data):
-        return {"id": str(csv_data["LEAGUE_ID"])}
+    csv_columns = {
+        "id": ("LEAGUE_ID", to_id),
+    }
 
 
-class Team(db.Model):
+class Team(JsonMapped, CsvMapped, db.Model):
     __tablename__ = "team"
 
     id = db.Column(db.String(20), primary_key=True)
@@ -75,50 +141,31 @@ class Team(db.Model):
     def __repr__(self):
         return f"<Team {self.id}>"
 
-    def to_json(self):
-        return {
-            "id": self.id,
-        }
+    json_columns = ["id"]
 
     @property
     def games(self):
         return self.home_games.union(self.away_games)
 
-    @staticmethod
-    def mapper(csv_data):
-        return {
-            "league_id": str(csv_data["LEAGUE_ID"]) if csv_data["LEAGUE_ID"] else None,
-            "id": str(csv_data["TEAM_ID"]) if csv_data["TEAM_ID"] else None,
-            "min_year": int(csv_data["MIN_YEAR"])
-            if not np.isnan(csv_data["MIN_YEAR"])
-            else None,
-            "max_year": int(csv_data["MAX_YEAR"])
-            if not np.isnan(csv_data["MAX_YEAR"])
-            else None,
-            "abbreviation": str(csv_data["ABBREVIATION"])
-            if csv_data["ABBREVIATION"]
-            else None,
-            "nickname": str(csv_data["NICKNAME"]) if csv_data["NICKNAME"] else None,
-            "yearfounded": int(csv_data["YEARFOUNDED"])
-            if not np.isnan(csv_data["YEARFOUNDED"])
-            else None,
-            "city": str(csv_data["CITY"]) if csv_data["CITY"] else None,
-            "arena": str(csv_data["ARENA"]) if csv_data["ARENA"] else None,
-            "arenacapacity": int(csv_data["ARENACAPACITY"])
-            if not np.isnan(csv_data["ARENACAPACITY"])
-            else None,
-            "owner": str(csv_data["OWNER"]) if csv_data["OWNER"] else None,
-            "generalmanager": str(csv_data["GENERALMANAGER"])
-            if csv_data["GENERALMANAGER"]
-            else None,
-            "headcoach": str(csv_data["HEADCOACH"]) if csv_data["HEADCOACH"] else None,
-            "dleagueaffiliation": str(csv_data["DLEAGUEAFFILIATION"])
-            if csv_data["DLEAGUEAFFILIATION"]
-            else None,
-        }
-
-
-class Player(db.Model):
+    csv_columns = {
+        "league_id": ("LEAGUE_ID", to_id),
+        "id": ("TEAM_ID", to_id),
+        "min_year": ("MIN_YEAR", to_int),
+        "max_year": ("MAX_YEAR", to_int),
+        "abbreviation": ("ABBREVIATION", to_str),
+        "nickname": ("NICKNAME", to_str),
+        "yearfounded": ("YEARFOUNDED", to_int),
+        "city": ("CITY", to_str),
+        "arena": ("ARENA", to_str),
+        "arenacapacity": ("ARENACAPACITY", to_int),
+        "owner": ("OWNER", to_str),
+        "generalmanager": ("GENERALMANAGER", to_str),
+        "headcoach": ("HEADCOACH", to_str),
+        "dleagueaffiliation": ("DLEAGUEAFFILIATION", to_str),
+    }
+
+
+class Player(JsonMapped, CsvMapped, db.Model):
     __tablename__ = "player"
 
     id = db.Column(db.String(20), primary_key=True)
@@ -130,21 +177,21 @@ class Player(db.Model):
     def __repr__(self):
         return f"<Player {self.id}>"
 
-    def to_json(self):
-        return {"id": self.id}
+    json_columns = ["id"]
 
-    @staticmethod
-    def mapper(csv_data):
-        return {
-            "player_name": str(csv_data["PLAYER_NAME"])
-            if csv_data["PLAYER_NAME"]
-            else None,
-            "id": str(csv_data["PLAYER_ID"]) if csv_data["PLAYER_ID"] else None,
-        }
+    csv_columns = {
+        "player_name": ("PLAYER_NAME", to_str),
+        "id": ("PLAYER_ID", to_id),
+    }
 
 
-class Game(db.Model):
+class Game(JsonMapped, CsvMapped, db.Model):
     __tablename__ = "game"
+    __table_args__ = (
+        db.Index("ix_game_game_date_est", "game_date_est"),
+        db.Index("ix_game_home_team_id_game_date_est", "home_team_id", "game_date_est"),
+        db.Index("ix_game_away_team_id_game_date_est", "away_team_id", "game_date_est"),
+    )
 
     id = db.Column(db.String(20), primary_key=True)
     game_date_est = db.Column(db.DateTime)
@@ -171,71 +218,32 @@ class Game(db.Model):
     def __repr__(self):
         return f"<Game {self.id}>"
 
-    def to_json(self):
-        return {"id": self.id}
-
-    @staticmethod
-    def mapper(csv_data):
-        return {
-            "game_date_est": csv_data["GAME_DATE_EST"]
-            if csv_data["GAME_DATE_EST"]
-            else None,
-            "id": str(csv_data["GAME_ID"]) if csv_data["GAME_ID"] else None,
-            "game_status_text": str(csv_data["GAME_STATUS_TEXT"])
-            if csv_data["GAME_STATUS_TEXT"]
-            else None,
-            "season": int(csv_data["SEASON"])
-            if not np.isnan(csv_data["SEASON"])
-            else None,
-            "home_team_id": str(csv_data["TEAM_ID_home"])
-            if csv_data["TEAM_ID_home"]
-            else None,
-            "pts_home": int(csv_data["PTS_home"])
-            if not np.isnan(csv_data["PTS_home"])
-            else None,
-            "fg_pct_home": float(csv_data["FG_PCT_home"])
-            if not np.isnan(csv_data["FG_PCT_home"])
-            else None,
-            "ft_pct_home": float(csv_data["FT_PCT_home"])
-            if not np.isnan(csv_data["FT_PCT_home"])
-            else None,
-            "fg3_pct_home": float(csv_data["FG3_PCT_home"])
-            if not np.isnan(csv_data["FG3_PCT_home"])
-            else None,
-            "ast_home": int(csv_data["AST_home"])
-            if not np.isnan(csv_data["AST_home"])
-            else None,
-            "reb_home": int(csv_data["REB_home"])
-            if not np.isnan(csv_data["REB_home"])
-            else None,
-            "away_team_id": str(csv_data["TEAM_ID_away"])
-            if csv_data["TEAM_ID_away"]
-            else None,
-            "pts_away": int(csv_data["PTS_away"])
-            if not np.isnan(csv_data["PTS_away"])
-            else None,
-            "fg_pct_away": float(csv_data["FG_PCT_away"])
-            if not np.isnan(csv_data["FG_PCT_away"])
-            else None,
-            "ft_pct_away": float(csv_data["FT_PCT_away"])
-            if not np.isnan(csv_data["FT_PCT_away"])
-            else None,
-            "fg3_pct_away": float(csv_data["FG3_PCT_away"])
-            if not np.isnan(csv_data["FG3_PCT_away"])
-            else None,
-            "ast_away": int(csv_data["AST_away"])
-            if not np.isnan(csv_data["AST_away"])
-            else None,
-            "reb_away": int(csv_data["REB_away"])
-            if not np.isnan(csv_data["REB_away"])
-            else None,
-            "home_team_wins": int(csv_data["HOME_TEAM_WINS"])
-            if not np.isnan(csv_data["HOME_TEAM_WINS"])
-            else None,
-        }
-
-
-class GameDetail(db.Model):
+    json_columns = ["id"]
+
+    csv_columns = {
+        "game_date_est": ("GAME_DATE_EST", to_str),
+        "id": ("GAME_ID", to_id),
+        "game_status_text": ("GAME_STATUS_TEXT", to_str),
+        "season": ("SEASON", to_int),
+        "home_team_id": ("TEAM_ID_home", to_id),
+        "pts_home": ("PTS_home", to_int),
+        "fg_pct_home": ("FG_PCT_home", to_float),
+        "ft_pct_home": ("FT_PCT_home", to_float),
+        "fg3_pct_home": ("FG3_PCT_home", to_float),
+        "ast_home": ("AST_home", to_int),
+        "reb_home": ("REB_home", to_int),
+        "away_team_id": ("TEAM_ID_away", to_id),
+        "pts_away": ("PTS_away", to_int),
+        "fg_pct_away": ("FG_PCT_away", to_float),
+        "ft_pct_away": ("FT_PCT_away", to_float),
+        "fg3_pct_away": ("FG3_PCT_away", to_float),
+        "ast_away": ("AST_away", to_int),
+        "reb_away": ("REB_away", to_int),
+        "home_team_wins": ("HOME_TEAM_WINS", to_int),
+    }
+
+
+class GameDetail(JsonMapped, CsvMapped, db.Model):
     __tablename__ = "game_detail"
 
     team_abbreviation = db.Column(db.String(10))
@@ -271,63 +279,66 @@ class GameDetail(db.Model):
     def __repr__(self):
         return f"<GameDetail {self.id}>"
 
-    def to_json(self):
-        return {
-            "game_id": self.game_id,
-            "team_id": self.team_id,
-            "player_id": self.player_id,
-        }
+    json_columns = ["game_id", "team_id", "player_id"]
+
+    csv_columns = {
+        "game_id": ("GAME_ID", to_id),
+        "team_id": ("TEAM_ID", to_id),
+        "team_abbreviation": ("TEAM_ABBREVIATION", to_str),
+        "team_city": ("TEAM_CITY", to_str),
+        "player_id": ("PLAYER_ID", to_id),
+        "player_name": ("PLAYER_NAME", to_str),
+        "start_position": ("START_POSITION", to_str),
+        "comment": ("COMMENT", to_str),
+        "min": ("MIN", to_str),
+        "fgm": ("FGM", to_int),
+        "fga": ("FGA", to_int),
+        "fg_pct": ("FG_PCT", to_float),
+        "fg3m": ("FG3M", to_int),
+        "fg3a": ("FG3A", to_int),
+        "fg3_pct": ("FG3_PCT", to_float),
+        "ftm": ("FTM", to_int),
+        "fta": ("FTA", to_int),
+        "ft_pct": ("FT_PCT", to_float),
+        "oreb": ("OREB", to_int),
+        "dreb": ("DREB", to_int),
+        "reb": ("REB", to_int),
+        "ast": ("AST", to_int),
+        "stl": ("STL", to_int),
+        "blk": ("BLK", to_int),
+        "to": ("TO", to_int),
+        "pf": ("PF", to_int),
+        "pts": ("PTS", to_int),
+        "plus_minus": ("PLUS_MINUS", to_int),
+    }
+
+
+class WeeklyPlayerTotal(db.Model):
+    __tablename__ = "weekly_player_totals"
+    __table_args__ = (
+        db.Index("ix_weekly_player_totals_yearweek_total", "yearweek", "total_stats"),
+    )
 
-    @staticmethod
-    def mapper(csv_data):
-        return {
-            "game_id": str(csv_data["GAME_ID"]) if csv_data["GAME_ID"] else None,
-            "team_id": str(csv_data["TEAM_ID"]) if csv_data["TEAM_ID"] else None,
-            "team_abbreviation": str(csv_data["TEAM_ABBREVIATION"])
-            if csv_data["TEAM_ABBREVIATION"]
-            else None,
-            "team_city": str(csv_data["TEAM_CITY"]) if csv_data["TEAM_CITY"] else None,
-            "player_id": str(csv_data["PLAYER_ID"]) if csv_data["PLAYER_ID"] else None,
-            "player_name": str(csv_data["PLAYER_NAME"])
-            if csv_data["PLAYER_NAME"]
-            else None,
-            "start_position": str(csv_data["START_POSITION"])
-            if csv_data["START_POSITION"]
-            else None,
-            "comment": str(csv_data["COMMENT"]) if csv_data["COMMENT"] else None,
-            "min": str(csv_data["MIN"]) if csv_data["MIN"] else None,
-            "fgm": int(csv_data["FGM"]) if not np.isnan(csv_data["FGM"]) else None,
-            "fga": int(csv_data["FGA"]) if not np.isnan(csv_data["FGA"]) else None,
-            "fg_pct": float(csv_data["FG_PCT"])
-            if not np.isnan(csv_data["FG_PCT"])
-            else None,
-            "fg3m": int(csv_data["FG3M"]) if not np.isnan(csv_data["FG3M"]) else None,
-            "fg3a": int(csv_data["FG3A"]) if not np.isnan(csv_data["FG3A"]) else None,
-            "fg3_pct": float(csv_data["FG3_PCT"])
-            if not np.isnan(csv_data["FG3_PCT"])
-            else None,
-            "ftm": int(csv_data["FTM"]) if not np.isnan(csv_data["FTM"]) else None,
-            "fta": int(csv_data["FTA"]) if not np.isnan(csv_data["FTA"]) else None,
-            "ft_pct": float(csv_data["FT_PCT"])
-            if not np.isnan(csv_data["FT_PCT"])
-            else None,
-            "oreb": int(csv_data["OREB"]) if not np.isnan(csv_data["OREB"]) else None,
-            "dreb": int(csv_data["DREB"]) if not np.isnan(csv_data["DREB"]) else None,
-            "reb": int(csv_data["REB"]) if not np.isnan(csv_data["REB"]) else None,
-            "ast": int(csv_data["AST"]) if not np.isnan(csv_data["AST"]) else None,
-            "stl": int(csv_data["STL"]) if not np.isnan(csv_data["STL"]) else None,
-            "blk": int(csv_data["BLK"]) if not np.isnan(csv_data["BLK"]) else None,
-            "to": int(csv_data["TO"]) if not np.isnan(csv_data["TO"]) else None,
-            "pf": int(csv_data["PF"]) if not np.isnan(csv_data["PF"]) else None,
-            "pts": int(csv_data["PTS"]) if not np.isnan(csv_data["PTS"]) else None,
-            "plus_minus": int(csv_data["PLUS_MINUS"])
-            if not np.isnan(csv_data["PLUS_MINUS"])
-            else None,
-        }
+    game_id = db.Column(db.String(20), primary_key=True)
+    team_id = db.Column(db.String(20), primary_key=True)
+    player_id = db.Column(db.String(20), primary_key=True)
+    yearweek = db.Column(db.Integer, nullable=False)
+    game_date_est = db.Column(db.DateTime)
+    player_name = db.Column(db.String(100))
+    reb = db.Column(db.Integer)
+    ast = db.Column(db.Integer)
+    pts = db.Column(db.Integer)
+    total_stats = db.Column(db.Integer)
+
+    def __repr__(self):
+        return f"<WeeklyPlayerTotal {self.yearweek} {self.player_id}>"
 
 
-class Ranking(db.Model):
+class Ranking(JsonMapped, CsvMapped, db.Model):
     __tablename__ = "ranking"
+    __table_args__ = (
+        db.Index("ix_ranking_team_id_standingsdate", "team_id", "standingsdate"),
+    )
 
     standingsdate = db.Column(db.DateTime, primary_key=True)
     conference = db.Column(db.String(10))
@@ -349,42 +360,33 @@ class Ranking(db.Model):
     def __repr__(self):
         return f"<Ranking {self.id}>"
 
-    def to_json(self):
-        return {
-            "team_id": self.team_id,
-            "league_id": self.league_id,
-            "season_id": self.season_id,
-        }
+    json_columns = ["team_id", "league_id", "season_id"]
 
-    @staticmethod
-    def mapper(csv_data):
-        return {
-            "team_id": str(csv_data["TEAM_ID"]) if csv_data["TEAM_ID"] else None,
-            "league_id": str(csv_data["LEAGUE_ID"]) if csv_data["LEAGUE_ID"] else None,
-            "season_id": str(csv_data["SEASON_ID"]) if csv_data["SEASON_ID"] else None,
-            "standingsdate": csv_data["STANDINGSDATE"]
-            if csv_data["STANDINGSDATE"]
-            else None,
-            "conference": str(csv_data["CONFERENCE"])
-            if csv_data["CONFERENCE"]
-            else None,
-            "team": str(csv_data["TEAM"]) if csv_data["TEAM"] else None,
-            "g": int(csv_data["G"]) if not np.isnan(csv_data["G"]) else None,
-            "w": int(csv_data["W"]) if not np.isnan(csv_data["W"]) else None,
-            "l": int(csv_data["L"]) if not np.isnan(csv_data["L"]) else None,
-            "w_pct": float(csv_data["W_PCT"])
-            if not np.isnan(csv_data["W_PCT"])
-            else None,
-            "home_record": str(csv_data["HOME_RECORD"])
-            if csv_data["HOME_RECORD"]
-            else None,
-            "road_record": str(csv_data["ROAD_RECORD"])
-            if csv_data["ROAD_RECORD"]
-            else None,
-            "returntoplay": int(csv_data["RETURNTOPLAY"])
-            if not np.isnan(csv_data["RETURNTOPLAY"])
-            else None,
-        }
+    csv_columns = {
+        "team_id": ("TEAM_ID", to_id),
+        "league_id": ("LEAGUE_ID", to_id),
+        "season_id": ("SEASON_ID", to_id),
+        "standingsdate": ("STANDINGSDATE", to_str),
+        "conference": ("CONFERENCE", to_str),
+        "team": ("TEAM", to_str),
+        "g": ("G", to_int),
+        "w": ("W", to_int),
+        "l": ("L", to_int),
+        "w_pct": ("W_PCT", to_float),
+        "home_record": ("HOME_RECORD", to_str),
+        "road_record": ("ROAD_RECORD", to_str),
+        "returntoplay": ("RETURNTOPLAY", to_int),
+    }
+
+
+class TableVersion(db.Model):
+    __tablename__ = "table_version"
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<TableVersion {self.name} {self.version}>"
 
 
 ENTITY_MAPPER = {
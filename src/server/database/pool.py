@@ -0,0 +1,82 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from . import config
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.peak_in_use = 0
+        self._lock = threading.Lock()
+
+    def record_checkout(self, wait, in_use, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.peak_in_use = max(self.peak_in_use, in_use)
+
+    def snapshot(self, pool):
+        with self._lock:
+            return {
+                "size": pool.size(),
+                "max_overflow": pool._max_overflow,
+                "in_use": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "peak_in_use": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg": self.wait_total / self.checkouts if self.checkouts else 0.0,
+                "wait_max": self.wait_max,
+            }
+
+
+POOL_STATS = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    # QueuePool has no event for the time spent waiting for a free connection.
+    # _do_get retries itself, so only the outermost call is timed
+    _waiting = threading.local()
+
+    def _do_get(self):
+        if getattr(self._waiting, "active", False):
+            return super()._do_get()
+
+        self._waiting.active = True
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            POOL_STATS.record_checkout(
+                time.perf_counter() - start, self.checkedout(), timed_out=True
+            )
+            raise
+        finally:
+            self._waiting.active = False
+        POOL_STATS.record_checkout(time.perf_counter() - start, self.checkedout())
+        return connection
+
+
+def engine_options():
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": config.POOL_SIZE,
+        "max_overflow": config.POOL_MAX_OVERFLOW,
+        "pool_timeout": config.POOL_TIMEOUT,
+        "pool_recycle": config.POOL_RECYCLE,
+        "pool_pre_ping": config.POOL_PRE_PING,
+    }
+    # Pooled sqlite connections are handed to whichever thread checks them out
+    if config.DATABASE_CONNECTION_URI.startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+    return options
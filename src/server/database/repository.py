@@ -1,4 +1,57 @@
-from .models import db
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, inspect, or_, select, tuple_
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.sql import text
+
+from .models import Game, GameDetail, TableVersion, WeeklyPlayerTotal, db
+
+WEEKLY_TOTALS_INSERT = """
+    INSERT INTO weekly_player_totals
+        (game_id, team_id, player_id, yearweek, game_date_est,
+         player_name, reb, ast, pts, total_stats)
+    SELECT game_detail.game_id, game_detail.team_id, game_detail.player_id,
+        YEARWEEK(game.game_date_est), game.game_date_est, game_detail.player_name,
+        game_detail.reb, game_detail.ast, game_detail.pts,
+        game_detail.reb + game_detail.ast + game_detail.pts
+    FROM game_detail, game
+    WHERE game_detail.game_id = game.id
+    """
+
+# Keeps the key lists of set-based statements within MySQL's packet size
+IN_CHUNK_SIZE = 1000
+
+VERSION_BUMP = text(
+    "UPDATE table_version SET version = version + 1 WHERE name IN :names"
+).bindparams(bindparam("names", expanding=True))
+
+
+@contextmanager
+def session_scope():
+    # The request's scoped session, committed as one transaction or rolled
+    # back so a failed request doesn't leave the session unusable
+    try:
+        yield db.session
+        commit_changes()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def fetch_rows(statement, **params):
+    result = db.session.execute(statement, params)
+    return list(result.keys()), result.all()
+
+
+def rows_after(model, column, after=None):
+    # Every row dated after `after`, or all of them, as dicts by column name
+    table = model.__table__
+    statement = select(table)
+    if after is not None:
+        statement = statement.where(table.c[column] > after)
+    return [dict(row) for row in db.session.execute(statement).mappings()]
 
 
 def get_all(model):
@@ -6,23 +59,364 @@ def get_all(model):
     return data
 
 
+def iter_rows(model, columns, after=None, limit=None):
+    # Column names, and the rows as tuples in that order
+    table = model.__table__
+    keys = list(table.primary_key.columns)
+    selected = keys + [table.c[name] for name in columns if table.c[name] not in keys]
+
+    statement = select(selected).order_by(*keys)
+    if after is not None:
+        # Compared as the key types, which strings from a URL are not
+        after = [_coerce(column, value) for column, value in zip(keys, after)]
+        statement = statement.where(_after_key(keys, after))
+    if limit is not None:
+        statement = statement.limit(limit)
+
+    names = [column.name for column in selected]
+    return names, _stream_rows(statement)
+
+
+def _after_key(keys, after):
+    # Spelled out as k1 > a1 OR (k1 = a1 AND k2 > a2) ..., which MySQL reads
+    # as ranges on the primary key, where it scans from the first row for a
+    # row constructor comparison
+    conditions = []
+    for i, (column, value) in enumerate(zip(keys, after)):
+        equal = [c == v for c, v in zip(keys[:i], after[:i])]
+        conditions.append(and_(*equal, column > value))
+    return or_(*conditions)
+
+
+def _stream_rows(statement):
+    # Server-side cursor on the request session's connection, rows are fetched
+    # while the response is being sent
+    con = db.session.connection().execution_options(stream_results=True)
+    for row in con.execute(statement):
+        yield tuple(row)
+
+
 def insert(model, **kwargs):
-    instance = model(**kwargs)
-    db.session.add(instance)
-    commit_changes()
+    with session_scope() as session:
+        instance = model(**kwargs)
+        session.add(instance)
+        bump_versions(model.__tablename__)
+        if model is Game:
+            session.flush()
+            refresh_weekly_player_totals(game_id=instance.id)
+        elif model is GameDetail:
+            session.flush()
+            refresh_weekly_player_totals(
+                game_id=instance.game_id,
+                team_id=instance.team_id,
+                player_id=instance.player_id,
+            )
 
 
 def delete(model, id):
-    model.query.filter_by(id=id).delete()
-    commit_changes()
+    with session_scope():
+        if model.query.filter_by(id=id).delete():
+            bump_versions(model.__tablename__)
+        if model is Game:
+            refresh_weekly_player_totals(game_id=id)
 
 
 def edit(model, id, **kwargs):
-    instance = model.query.filter_by(id=id).all()[0]
-    for attr, new_value in kwargs.items():
-        setattr(instance, attr, new_value)
-    commit_changes()
+    with session_scope() as session:
+        instance = model.query.filter_by(id=id).all()[0]
+        for attr, new_value in kwargs.items():
+            setattr(instance, attr, new_value)
+        bump_versions(model.__tablename__)
+        if model is Game:
+            session.flush()
+            refresh_weekly_player_totals(game_id=id)
+
+
+# Bulk changes
+# Every bulk change runs in the caller's transaction and returns one status per
+# input row, in input order
+
+
+def bulk_insert(model, rows):
+    table = model.__table__
+    statuses = [None] * len(rows)
+    keyed = {}
+    values = [None] * len(rows)
+    for i, row in enumerate(rows):
+        values[i], key, error = _parse_row(table, row)
+        if error is not None:
+            statuses[i] = {"status": "invalid", "error": error}
+        elif key in keyed:
+            statuses[i] = {"status": "duplicate"}
+        else:
+            keyed[key] = i
+
+    existing = _existing_keys(table, list(keyed))
+    groups = defaultdict(list)
+    for key, i in keyed.items():
+        if key in existing:
+            statuses[i] = {"status": "exists"}
+        else:
+            # executemany needs the same columns in every row of a statement
+            groups[tuple(sorted(values[i]))].append(values[i])
+            statuses[i] = {"status": "added"}
+
+    for group in groups.values():
+        db.session.execute(table.insert(), group)
+    if groups:
+        bump_versions(table.name)
+
+    _refresh_games(model, [key for key, i in keyed.items() if key not in existing])
+    return statuses
+
+
+def bulk_edit(model, rows):
+    table = model.__table__
+    key_names = [column.name for column in table.primary_key.columns]
+    statuses = [None] * len(rows)
+    values = [None] * len(rows)
+    keyed = {}
+    for i, row in enumerate(rows):
+        values[i], key, error = _parse_row(table, row)
+        if error is not None:
+            statuses[i] = {"status": "invalid", "error": error}
+        elif key in keyed:
+            statuses[i] = {"status": "duplicate"}
+        else:
+            keyed[key] = i
+
+    existing = _existing_keys(table, list(keyed))
+    groups = defaultdict(list)
+    for key, i in keyed.items():
+        if key not in existing:
+            statuses[i] = {"status": "not_found"}
+            continue
+        changes = {k: v for k, v in values[i].items() if k not in key_names}
+        if changes:
+            groups[tuple(sorted(changes))].append((key, changes))
+        statuses[i] = {"status": "edited"}
+
+    for columns, group in groups.items():
+        new_values = {tuple(changes[c] for c in columns) for _, changes in group}
+        if len(new_values) == 1:
+            # Same new values for every row: one UPDATE ... WHERE key IN
+            for keys in _chunks([key for key, _ in group]):
+                db.session.execute(
+                    table.update().where(_key_in(table, keys)).values(group[0][1])
+                )
+            continue
+
+        statement = (
+            table.update()
+            .where(
+                and_(
+                    *[
+                        column == bindparam("key_" + column.name)
+                        for column in table.primary_key.columns
+                    ]
+                )
+            )
+            .values({c: bindparam("new_" + c) for c in columns})
+        )
+        db.session.execute(
+            statement,
+            [
+                {
+                    **{"key_" + k: v for k, v in zip(key_names, key)},
+                    **{"new_" + c: v for c, v in changes.items()},
+                }
+                for key, changes in group
+            ],
+        )
+
+    if groups:
+        bump_versions(table.name)
+    _refresh_games(model, [key for key, _ in keyed.items() if key in existing])
+    return statuses
+
+
+def bulk_delete(model, keys):
+    table = model.__table__
+    key_names = [column.name for column in table.primary_key.columns]
+    statuses = [None] * len(keys)
+    keyed = {}
+    for i, key in enumerate(keys):
+        # Tables keyed by a single column also accept bare ids
+        if not isinstance(key, dict) and len(key_names) == 1:
+            key = {key_names[0]: key}
+        _, key, error = _parse_row(table, key)
+        if error is not None:
+            statuses[i] = {"status": "invalid", "error": error}
+        elif key in keyed:
+            statuses[i] = {"status": "duplicate"}
+        else:
+            keyed[key] = i
+
+    existing = _existing_keys(table, list(keyed))
+    for key, i in keyed.items():
+        statuses[i] = {"status": "deleted" if key in existing else "not_found"}
+
+    for chunk in _chunks(list(existing)):
+        db.session.execute(table.delete().where(_key_in(table, chunk)))
+    if existing:
+        bump_versions(table.name)
+
+    _refresh_games(model, existing)
+    return statuses
+
+
+def _parse_row(table, row):
+    # Values are converted to their column types up front, so keys compare
+    # equal to the ones read back from the database
+    if not isinstance(row, dict):
+        return None, None, "expected an object"
+    unknown = [k for k in row if k not in table.c]
+    if unknown:
+        return None, None, f"unknown columns: {', '.join(unknown)}"
+
+    values = {}
+    for name, value in row.items():
+        if value is None:
+            values[name] = None
+            continue
+        try:
+            values[name] = _coerce(table.c[name], value)
+        except (TypeError, ValueError):
+            return None, None, f"invalid value for {name}"
+
+    key = []
+    for column in table.primary_key.columns:
+        if values.get(column.name) is None:
+            return None, None, f"missing key column {column.name}"
+        key.append(values[column.name])
+    return values, tuple(key), None
+
+
+def _coerce(column, value):
+    if isinstance(value, (list, dict)):
+        raise TypeError(f"{column.name} must be a scalar")
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(str(value))
+    return python_type(value)
+
+
+def _chunks(items):
+    for start in range(0, len(items), IN_CHUNK_SIZE):
+        yield items[start : start + IN_CHUNK_SIZE]
+
+
+def _key_in(table, keys):
+    columns = list(table.primary_key.columns)
+    if len(columns) == 1:
+        return columns[0].in_([key[0] for key in keys])
+    return tuple_(*columns).in_(keys)
+
+
+def _existing_keys(table, keys):
+    columns = list(table.primary_key.columns)
+    existing = set()
+    for chunk in _chunks(keys):
+        rows = db.session.execute(select(columns).where(_key_in(table, chunk)))
+        existing.update(tuple(row) for row in rows)
+    return existing
+
+
+def _refresh_games(model, keys):
+    # Game and GameDetail keys both start with the game id
+    if model is Game or model is GameDetail:
+        refresh_weekly_player_totals_for_games({key[0] for key in keys})
 
 
 def commit_changes():
     db.session.commit()
+
+
+def create_missing_indexes(engine):
+    # create_all only creates indexes together with new tables
+    inspector = inspect(engine)
+    for table in db.Model.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(bind=engine)
+            except DBAPIError:
+                # Workers starting together race to create it, and one wins
+                created = inspect(engine).get_indexes(table.name)
+                if index.name not in {row["name"] for row in created}:
+                    raise
+
+
+# Weekly leaders summary table
+
+
+def refresh_weekly_player_totals(**keys):
+    where = " AND ".join(f"{key} = :{key}" for key in keys)
+    db.session.execute(text(f"DELETE FROM weekly_player_totals WHERE {where}"), keys)
+
+    where = " AND ".join(f"game_detail.{key} = :{key}" for key in keys)
+    db.session.execute(text(f"{WEEKLY_TOTALS_INSERT} AND {where}"), keys)
+    bump_versions(WeeklyPlayerTotal.__tablename__)
+
+
+def refresh_weekly_player_totals_for_games(game_ids, connection=None):
+    executor = connection if connection is not None else db.session
+    game_ids = list(game_ids)
+    if game_ids:
+        bump_versions(WeeklyPlayerTotal.__tablename__, connection=connection)
+    for chunk in _chunks(game_ids):
+        params = {"game_ids": chunk}
+        game_ids_param = bindparam("game_ids", expanding=True)
+        executor.execute(
+            text(
+                "DELETE FROM weekly_player_totals WHERE game_id IN :game_ids"
+            ).bindparams(game_ids_param),
+            params,
+        )
+        executor.execute(
+            text(f"{WEEKLY_TOTALS_INSERT} AND game.id IN :game_ids").bindparams(
+                game_ids_param
+            ),
+            params,
+        )
+
+
+# Table versions
+# Every write bumps the version of the tables it changed, in the same
+# transaction, so a response built from the same versions is still valid.
+# They are kept in the database, so writes from other server processes and
+# bulk loads count too
+
+
+def bump_versions(*names, connection=None):
+    executor = connection if connection is not None else db.session
+    executor.execute(VERSION_BUMP, {"names": list(names)})
+
+
+def table_versions(names):
+    statement = select(TableVersion.name, TableVersion.version).where(
+        TableVersion.name.in_(names)
+    )
+    versions = dict(db.session.execute(statement).all())
+    return tuple(versions.get(name, 0) for name in names)
+
+
+def create_table_versions(engine):
+    # Rows are created up front, so bumping a version is a plain UPDATE
+    with engine.connect() as con:
+        existing = {name for name, in con.execute(select(TableVersion.name))}
+    missing = [
+        {"name": table.name, "version": 0}
+        for table in db.Model.metadata.sorted_tables
+        if table.name not in existing
+    ]
+    if not missing:
+        return
+    try:
+        with engine.begin() as con:
+            con.execute(TableVersion.__table__.insert(), missing)
+    except IntegrityError:
+        # Another process created them first
+        pass
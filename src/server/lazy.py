@@ -0,0 +1,24 @@
+import threading
+
+
+class LazyResource:
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        # Double-checked so only the first caller pays for the load and
+        # concurrent requests wait for it instead of loading twice
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self._loader()
+                    self._loaded = True
+        return self._value
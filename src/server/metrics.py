@@ -0,0 +1,319 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import request
+from sqlalchemy import event
+
+# Metrics in the Prometheus text format, kept in process. With
+# PREDICTION_WORKERS, the stages scored in worker processes are not recorded
+
+# Seconds, from cache hits to slow batch predictions
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+REGISTRY = []
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labels, k)} {v}" for k, v in values]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # Per label values: observations per bucket (the last one is +Inf),
+        # then their sum
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[bucket] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+
+        lines = []
+        names = self.labels + ("le",)
+        for labels, values in series:
+            total = 0
+            for le, count in zip(self.buckets + ("+Inf",), values):
+                total += count
+                lines.append(
+                    f"{self.name}_bucket{_labels(names, labels + (le,))} {total}"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {values[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {total}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by endpoint",
+    ("endpoint", "method", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being served by endpoint", ("endpoint",)
+)
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds", "Time spent in each instrumented stage", ("stage",)
+)
+DB_SECONDS = Histogram(
+    "db_query_duration_seconds", "Database statement time by endpoint", ("endpoint",)
+)
+
+
+def _reset_locks():
+    # A forked prediction worker still records its stages, and a thread of the
+    # parent may have held any of these locks at the fork
+    for metric in REGISTRY:
+        metric._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks)
+
+
+def render(stats=None):
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines += metric.render()
+
+    # Point-in-time stats the server already keeps, as {prefix: {name: value}}
+    for prefix, values in (stats or {}).items():
+        for name, value in values.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                lines.append(f"{prefix}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Per-request timings
+# Every request thread keeps the time of the stages and statements it ran, so
+# responses can report them in a Server-Timing header
+
+_request = threading.local()
+
+
+def _current_endpoint():
+    return getattr(_request, "endpoint", None) or "none"
+
+
+def _add_timing(name, seconds):
+    timings = getattr(_request, "timings", None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        _add_timing(stage, elapsed)
+
+
+def instrument_app(flask_app):
+    @flask_app.before_request
+    def start_request():
+        rule = request.url_rule
+        _request.endpoint = rule.rule if rule is not None else "unmatched"
+        _request.status = 500
+        _request.timings = {}
+        _request.start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc(_request.endpoint)
+
+    @flask_app.after_request
+    def server_timing(response):
+        _request.status = response.status_code
+        timings = getattr(_request, "timings", None)
+        if timings:
+            response.headers["Server-Timing"] = ", ".join(
+                f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()
+            )
+        return response
+
+    # Also runs for unhandled errors, which skip after_request
+    @flask_app.teardown_request
+    def finish_request(exception=None):
+        endpoint = getattr(_request, "endpoint", None)
+        if endpoint is None:
+            return
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - _request.start,
+            endpoint,
+            request.method,
+            _request.status,
+        )
+        REQUESTS_IN_FLIGHT.dec(endpoint)
+        _request.endpoint = None
+        _request.timings = None
+
+
+def instrument_engine(engine):
+    # The start time and endpoint live on the execution context, which is
+    # dropped with the statement even when it fails and after_cursor_execute
+    # never runs. The endpoint is taken when the statement starts, so rows
+    # fetched while a streamed response is sent still count for its endpoint
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_start = time.perf_counter()
+            context.query_endpoint = _current_endpoint()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def finish_query(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "query_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        DB_SECONDS.observe(elapsed, context.query_endpoint)
+        _add_timing("db", elapsed)
+
+
+# Sampling profiler
+# Off by default. While it runs, a thread records the stack of every other
+# thread at a fixed interval; the counts are returned in the collapsed format
+# flamegraph.pl and speedscope read
+
+
+class SamplingProfiler:
+    def __init__(self, interval_ms=10):
+        self.interval = interval_ms / 1000
+        self.samples = 0
+        self._stacks = Counter()
+        self._thread = None
+        self._stop = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def start(self, interval_ms=None):
+        with self._lock:
+            if interval_ms is not None:
+                self.interval = interval_ms / 1000
+            if self._thread is None:
+                self._stop = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run,
+                    args=(self._stop,),
+                    name="sampling-profiler",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._stop.set()
+        if thread is not None:
+            thread.join()
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def collapsed(self):
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "interval_ms": self.interval * 1000,
+                "samples": self.samples,
+                "stacks": len(self._stacks),
+            }
+
+    def _run(self, stop):
+        own = threading.get_ident()
+        while not stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, frame in frames.items():
+                    if thread_id != own:
+                        self._stacks[_collapse(frame)] += 1
+                self.samples += 1
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
@@ -1,74 +1,359 @@
+import argparse
 import json
 import os
-import sys
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
 
 import pandas as pd
 import requests
+from sqlalchemy import DateTime, create_engine
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.sql import text
 
+from database import config
 from database.models import *
+from database.repository import (
+    WEEKLY_TOTALS_INSERT,
+    bump_versions,
+    create_missing_indexes,
+    create_table_versions,
+    refresh_weekly_player_totals_for_games,
+)
 
 BASE_URL = "http://127.0.0.1:5000"
 
 # Data normalization
 
+PLAYER_COLUMNS = ["PLAYER_ID", "PLAYER_NAME"]
 
-def get_players_from_players_csv(csv_dir="../../data/nba_dataset/players.csv"):
-    df = pd.read_csv(csv_dir)
-    print(len(df))
-    df = df.drop_duplicates(subset=["PLAYER_ID"])
-    print(len(df))
-    df = df[["PLAYER_ID", "PLAYER_NAME"]]
-    return df
 
-
-def get_players_from_game_details_csv(
-    csv_dir="../../data/nba_dataset/games_details.csv",
+def extract_players(
+    dataset_dir: str = "../../data/nba_dataset",
+    to: str = "../../data/nba_dataset",
+    chunk_size: int = 100000,
 ):
-    df = pd.read_csv(csv_dir)
-    print(len(df))
-    df = df.drop_duplicates(subset=["PLAYER_ID"])
-    print(len(df))
-    df = df[["PLAYER_ID", "PLAYER_NAME"]]
-    return df
+    sources = [f"{dataset_dir}/players.csv", f"{dataset_dir}/games_details.csv"]
+
+    seen = set()
+    header = True
+    for csv_dir in sources:
+        chunks = pd.read_csv(
+            csv_dir,
+            usecols=PLAYER_COLUMNS,
+            dtype={"PLAYER_ID": str},
+            chunksize=chunk_size,
+        )
+        for chunk in chunks:
+            chunk = chunk.drop_duplicates(subset=["PLAYER_ID"])
+            chunk = chunk.loc[~chunk["PLAYER_ID"].isin(seen), PLAYER_COLUMNS]
+            seen.update(chunk["PLAYER_ID"])
+
+            chunk.to_csv(
+                f"{to}/cleaned_players.csv",
+                mode="w" if header else "a",
+                header=header,
+                index=False,
+            )
+            header = False
+
+        print(f"{csv_dir}: {len(seen)} players")
 
 
-def extract_players(
-    dataset_dir: str = "../../data/nba_dataset", to: str = "../../data/nba_dataset"
+# Database population
+
+
+def read_csv_chunks(
+    data_dir: str,
+    entity: str,
+    chunk_size: int = 10000,
+    limit: int = None,
+    skip: int = 0,
 ):
-    df1 = get_players_from_players_csv(f"{dataset_dir}/players.csv")
-    df2 = get_players_from_game_details_csv(f"{dataset_dir}/games_details.csv")
-    df = pd.concat([df1, df2])
-    df = df.drop_duplicates(subset=["PLAYER_ID"])
-    df.to_csv(f"{to}/cleaned_players.csv", index=False)
+    model = ENTITY_MAPPER[entity]
+    dtypes = model.csv_dtypes()
+    return pd.read_csv(
+        data_dir,
+        usecols=list(dtypes),
+        dtype=dtypes,
+        chunksize=chunk_size,
+        nrows=limit,
+        skiprows=range(1, skip + 1),
+    )
 
 
-# Database population
+def stream_records(
+    data_dir: str,
+    entity: str,
+    chunk_size: int = 10000,
+    limit: int = None,
+    max_in_flight: int = 4,
+    skip: int = 0,
+):
+    mapper = ENTITY_MAPPER[entity].frame_mapper
+    chunks = queue.Queue(maxsize=max_in_flight)
+
+    # Parse and map the next chunks while the caller is writing the current one
+    def _read():
+        try:
+            for chunk in read_csv_chunks(data_dir, entity, chunk_size, limit, skip):
+                if len(chunk):
+                    chunks.put(mapper(chunk).to_dict("records"))
+        except Exception as error:
+            chunks.put(error)
+        else:
+            chunks.put(None)
+
+    threading.Thread(target=_read, daemon=True).start()
+
+    while True:
+        records = chunks.get()
+        if records is None:
+            return
+        if isinstance(records, Exception):
+            raise records
+        yield records
 
 
 def populate_table(data_dir: str, entity: str, limit: int = None):
     if not data_dir or not entity:
         raise ValueError("data_dir and entity are needed")
 
-    df = pd.read_csv(data_dir)
-    total = len(df)
-
     url = f"{BASE_URL}/add/{entity}"
-    entity = ENTITY_MAPPER[entity]
 
+    index = 0
     inserted = 0
-    for index, data in df.iterrows():
-        headers = {"Content-type": "application/json"}
-        payload = json.dumps(entity.mapper(dict(data)))
-        response = requests.request("POST", url, headers=headers, data=payload)
-        if response.status_code == 200:
-            inserted += 1
-            if limit is not None and inserted >= limit:
-                break
+    for records in stream_records(data_dir, entity):
+        for data in records:
+            headers = {"Content-type": "application/json"}
+            payload = json.dumps(data)
+            response = requests.request("POST", url, headers=headers, data=payload)
+            print(f"{index}: {response.status_code} - {response.text}")
+            index += 1
+
+            if response.status_code == 200:
+                inserted += 1
+                if limit is not None and inserted >= limit:
+                    return
+
+
+def load_checkpoint(checkpoint: str):
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return 0
+    with open(checkpoint) as f:
+        return json.load(f)["rows"]
+
+
+def save_checkpoint(checkpoint: str, rows: int):
+    with open(f"{checkpoint}.tmp", "w") as f:
+        json.dump({"rows": rows}, f)
+    os.replace(f"{checkpoint}.tmp", checkpoint)
+
+
+def upsert_statement(table, dialect="mysql"):
+    columns = [c.name for c in table.columns if not c.primary_key]
+    # sqlite is what the benchmarks load into
+    if dialect == "sqlite":
+        statement = sqlite.insert(table)
+        if not columns:
+            return statement.on_conflict_do_nothing()
+        return statement.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_={name: statement.excluded[name] for name in columns},
+        )
+
+    statement = mysql.insert(table)
+    if not columns:
+        columns = [c.name for c in table.primary_key.columns]
+    return statement.on_duplicate_key_update(
+        {name: statement.inserted[name] for name in columns}
+    )
 
-        print(f"{index}/{total}: {response.status_code} - {response.text}")
 
+def _sqlite_rows(table, rows):
+    # sqlite only binds datetime objects to DateTime columns, where MySQL
+    # parses the CSV strings
+    dates = [c.name for c in table.columns if isinstance(c.type, DateTime)]
+    for row in rows:
+        for name in dates:
+            if isinstance(row.get(name), str):
+                row[name] = datetime.fromisoformat(row[name])
+    return rows
+
+
+def _insert_chunk(engine, statement, rows):
+    if engine.dialect.name == "sqlite":
+        rows = _sqlite_rows(statement.table, rows)
+    with engine.begin() as con:
+        con.execute(statement, rows)
+    return len(rows)
+
+
+def bulk_populate_table(
+    engine,
+    data_dir: str,
+    entity: str,
+    limit: int = None,
+    chunk_size: int = 10000,
+    max_in_flight: int = 4,
+    shards: int = 1,
+    checkpoint: str = None,
+    game_ids: set = None,
+):
+    # game_ids collects the game of every loaded row, for tables keyed by it
+    if not data_dir or not entity:
+        raise ValueError("data_dir and entity are needed")
 
-def populate_database(dataset_dir="../../data/nba_dataset", limit=10000):
+    table = ENTITY_MAPPER[entity].__table__
+    statement = upsert_statement(table, engine.dialect.name)
+    # Game and GameDetail keys both start with the game id
+    game_key = list(table.primary_key.columns)[0].name
+
+    # Rows before the checkpoint are already committed
+    skip = load_checkpoint(checkpoint)
+    if limit is not None:
+        limit = max(limit - skip, 0)
+    if skip:
+        print(f"{entity}: resuming after {skip} rows")
+
+    # Chunks may commit out of order across shards, so the checkpoint only
+    # moves past chunks once every earlier chunk is committed too
+    committed = {}
+    next_chunk = 0
+    inserted = 0
+    start = time.perf_counter()
+
+    def _report(done):
+        nonlocal inserted, next_chunk, skip
+        for future in done:
+            committed[pending[future]] = future.result()
+        while next_chunk in committed:
+            rows = committed.pop(next_chunk)
+            inserted += rows
+            skip += rows
+            next_chunk += 1
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, skip)
+
+        elapsed = time.perf_counter() - start
+        print(f"{entity} {inserted}: {inserted / elapsed:.0f} rows/s")
+
+    # Every shard writes whole chunks through its own pooled connection
+    with ThreadPoolExecutor(max_workers=shards) as writers:
+        pending = {}
+        records = stream_records(
+            data_dir, entity, chunk_size, limit, max_in_flight, skip
+        )
+        for index, rows in enumerate(records):
+            if game_ids is not None:
+                game_ids.update(row[game_key] for row in rows)
+            future = writers.submit(_insert_chunk, engine, statement, rows)
+            pending[future] = index
+            if len(pending) >= shards:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _report(done)
+                for future in done:
+                    del pending[future]
+
+        if pending:
+            done, _ = wait(pending)
+            _report(done)
+
+    # Bumped once the whole table is loaded rather than in every chunk, where
+    # shards would queue on the version row. Responses read during the load
+    # may be reused until then
+    if inserted:
+        with engine.begin() as con:
+            bump_versions(table.name, connection=con)
+    return inserted
+
+
+def rebuild_weekly_player_totals(engine):
+    with engine.begin() as con:
+        con.execute(text("DELETE FROM weekly_player_totals"))
+        con.execute(text(WEEKLY_TOTALS_INSERT))
+        bump_versions(WeeklyPlayerTotal.__tablename__, connection=con)
+
+
+def refresh_weekly_player_totals(engine, game_ids):
+    with engine.begin() as con:
+        refresh_weekly_player_totals_for_games(game_ids, connection=con)
+
+
+# Tables weekly_player_totals is built from
+WEEKLY_TOTALS_SOURCES = ["games", "games_details"]
+
+TABLES = {
+    "leagues": "leagues.csv",
+    "teams": "teams.csv",
+    "players": "cleaned_players.csv",
+    "players_teams": "players.csv",
+    "games": "games.csv",
+    "games_details": "games_details.csv",
+    "rankings": "ranking.csv",
+}
+
+
+def table_dependencies(entities):
+    entity_tables = {ENTITY_MAPPER[entity].__tablename__: entity for entity in entities}
+
+    dependencies = {}
+    for entity in entities:
+        table = ENTITY_MAPPER[entity].__table__
+        referenced = {key.column.table.name for key in table.foreign_keys}
+        dependencies[entity] = {
+            entity_tables[name]
+            for name in referenced
+            if name in entity_tables and name != table.name
+        }
+    return dependencies
+
+
+def dependency_order(dependencies):
+    done = []
+    while len(done) < len(dependencies):
+        ready = [
+            entity
+            for entity, requires in dependencies.items()
+            if entity not in done and requires.issubset(done)
+        ]
+        if not ready:
+            raise ValueError("Circular foreign keys between tables")
+        done += ready
+    return done
+
+
+def run_in_dependency_order(dependencies, load, workers: int = 4):
+    dependency_order(dependencies)
+
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while len(done) < len(dependencies):
+            for entity, requires in dependencies.items():
+                scheduled = entity in done or entity in running.values()
+                if not scheduled and requires.issubset(done):
+                    running[pool.submit(load, entity)] = entity
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.result()
+                done.add(running.pop(future))
+
+
+def populate_database(
+    dataset_dir="../../data/nba_dataset",
+    limit=10000,
+    bulk=False,
+    chunk_size=10000,
+    max_in_flight=4,
+    workers=4,
+    shards=1,
+    checkpoint_dir=None,
+    restart=False,
+):
     if not os.path.exists(dataset_dir):
         raise ValueError("Invalid dataset path")
 
@@ -77,46 +362,137 @@ def populate_database(dataset_dir="../../data/nba_dataset", limit=10000):
 
         extract_players(dataset_dir=dataset_dir, to=dataset_dir)
 
-    print("\n... Populating table: leagues")
-    populate_table(data_dir=f"{dataset_dir}/leagues.csv", entity="leagues", limit=limit)
-
-    print("\n... Populating table: teams")
-    populate_table(data_dir=f"{dataset_dir}/teams.csv", entity="teams", limit=limit)
-
-    print("\n... Populating table: players")
-    populate_table(
-        data_dir=f"{dataset_dir}/cleaned_players.csv", entity="players", limit=limit
+    dependencies = table_dependencies(list(TABLES))
+
+    if not bulk:
+        for entity in dependency_order(dependencies):
+            print(f"\n... Populating table: {entity}")
+            populate_table(
+                data_dir=f"{dataset_dir}/{TABLES[entity]}", entity=entity, limit=limit
+            )
+        return
+
+    engine = create_engine(
+        config.DATABASE_CONNECTION_URI,
+        pool_size=workers * shards,
+        max_overflow=0,
+        pool_recycle=config.POOL_RECYCLE,
+        pool_pre_ping=config.POOL_PRE_PING,
     )
-
-    print("\n... Populating table: players_teams")
-    populate_table(
-        data_dir=f"{dataset_dir}/players.csv", entity="players_teams", limit=limit
+    db.Model.metadata.create_all(engine)
+    create_missing_indexes(engine)
+    create_table_versions(engine)
+
+    if checkpoint_dir is None:
+        checkpoint_dir = f"{dataset_dir}/.checkpoints"
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    # The marker keeps the games and games_details offsets of the last
+    # weekly totals refresh. Rows loaded past them by an earlier run that
+    # stopped before refreshing are not known by game, so they need a rebuild
+    marker = f"{checkpoint_dir}/{WeeklyPlayerTotal.__tablename__}.json"
+    offsets = {
+        entity: 0 if restart else load_checkpoint(f"{checkpoint_dir}/{entity}.json")
+        for entity in WEEKLY_TOTALS_SOURCES
+    }
+    rebuild = load_checkpoint(marker) != offsets and any(offsets.values())
+
+    inserted = {}
+    game_ids = set()
+
+    def _load(entity):
+        checkpoint = f"{checkpoint_dir}/{entity}.json"
+        if restart and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        print(f"\n... Populating table: {entity}")
+        inserted[entity] = bulk_populate_table(
+            engine,
+            data_dir=f"{dataset_dir}/{TABLES[entity]}",
+            entity=entity,
+            limit=limit,
+            chunk_size=chunk_size,
+            max_in_flight=max_in_flight,
+            shards=shards,
+            checkpoint=checkpoint,
+            game_ids=game_ids if entity in WEEKLY_TOTALS_SOURCES else None,
+        )
+
+    run_in_dependency_order(dependencies, _load, workers=workers)
+
+    if rebuild:
+        print("\n... Rebuilding table: weekly_player_totals")
+        rebuild_weekly_player_totals(engine)
+    elif game_ids:
+        print(f"\n... Refreshing weekly_player_totals for {len(game_ids)} games")
+        refresh_weekly_player_totals(engine, game_ids)
+    save_checkpoint(
+        marker,
+        {
+            entity: load_checkpoint(f"{checkpoint_dir}/{entity}.json")
+            for entity in WEEKLY_TOTALS_SOURCES
+        },
     )
 
-    print("\n... Populating table: games")
-    populate_table(data_dir=f"{dataset_dir}/games.csv", entity="games", limit=limit)
 
-    print("\n... Populating table: games_details")
-    populate_table(
-        data_dir=f"{dataset_dir}/games_details.csv", entity="games_details", limit=limit
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset_dir", nargs="?", default="../../data/nba_dataset")
+    parser.add_argument("limit", nargs="?", type=int, default=None)
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="insert straight into the database instead of POSTing every row",
     )
-
-    print("\n... Populating table: rankings")
-    populate_table(
-        data_dir=f"{dataset_dir}/ranking.csv", entity="rankings", limit=limit
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=4,
+        help="parsed chunks allowed to wait for the database writer",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="tables loaded concurrently once their foreign keys are loaded",
+    )
+    parser.add_argument(
+        "--shards", type=int, default=1, help="concurrent chunk writers per table"
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        default=None,
+        help="where committed row offsets are kept (default: DATASET_DIR/.checkpoints)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="ignore the checkpoints and upsert every CSV from the first row",
+    )
+    parser.add_argument(
+        "--rebuild-weekly-totals",
+        action="store_true",
+        help="only rebuild weekly_player_totals from the loaded games, e.g. for "
+        "a database loaded before the table existed",
+    )
+    args = parser.parse_args()
+
+    if args.rebuild_weekly_totals:
+        engine = create_engine(config.DATABASE_CONNECTION_URI)
+        db.Model.metadata.create_all(engine)
+        create_table_versions(engine)
+        rebuild_weekly_player_totals(engine)
+        raise SystemExit
+
+    populate_database(
+        dataset_dir=args.dataset_dir,
+        limit=args.limit,
+        bulk=args.bulk,
+        chunk_size=args.chunk_size,
+        max_in_flight=args.max_in_flight,
+        workers=args.workers,
+        shards=args.shards,
+        checkpoint_dir=args.checkpoint_dir,
+        restart=args.restart,
     )
-
-
-if __name__ == "__main__":
-    dataset_dir = "../../data/nba_dataset"
-    limit = None
-
-    if len(sys.argv) > 1:
-        dataset_dir = sys.argv[1]
-    if len(sys.argv) > 2:
-        limit = int(sys.argv[2])
-
-    if dataset_dir=="--help" or dataset_dir=="-h":
-            print(f"USAGE: {sys.argv[0]} NBA_DATASET_DIR LIMIT")
-    else:
-        populate_database(dataset_dir=dataset_dir, limit=limit)
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatcher:
+    def __init__(self, predict_batch, max_batch_size=64, max_wait_ms=5, concurrency=1):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.concurrency = concurrency
+        self.batches = 0
+        self.items = 0
+
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # Up to `concurrency` batches are scored at a time while the loop keeps
+        # collecting the next one
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                started = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run,
+                    args=(started,),
+                    name="prediction-batcher",
+                    daemon=True,
+                )
+                self._thread.start()
+                started.wait()
+
+    def predict(self, item, timeout=None):
+        # Called from the WSGI worker threads, which block until their batch
+        # has been scored
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self.submit(item), self._loop)
+        return future.result(timeout)
+
+    async def submit(self, item):
+        future = self._loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    def _run(self, started):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._loop.call_soon(started.set)
+        self._loop.run_until_complete(self._serve())
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _serve(self):
+        scoring = asyncio.Semaphore(self.concurrency)
+        while True:
+            await scoring.acquire()
+            batch = await self._collect()
+            task = self._loop.create_task(self._score(batch))
+            task.add_done_callback(lambda _: scoring.release())
+
+    async def _score(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = await self._loop.run_in_executor(
+                self._executor, self.predict_batch, items
+            )
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        self.batches += 1
+        self.items += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class PredictionCache:
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._team_keys = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._discard(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, teams):
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, teams)
+            for team in teams:
+                self._team_keys[team].add(key)
+
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_teams(self, teams):
+        with self._lock:
+            for team in teams:
+                for key in list(self._team_keys.get(team, ())):
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._team_keys.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _discard(self, key):
+        _, _, teams = self._entries.pop(key)
+        for team in teams:
+            keys = self._team_keys[team]
+            keys.discard(key)
+            if not keys:
+                del self._team_keys[team]
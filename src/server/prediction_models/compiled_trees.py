@@ -0,0 +1,281 @@
+import argparse
+import hashlib
+import json
+import os
+
+import joblib
+import numpy as np
+from sklearn.ensemble import (
+    ExtraTreesClassifier,
+    ExtraTreesRegressor,
+    RandomForestClassifier,
+    RandomForestRegressor,
+)
+from sklearn.tree import (
+    DecisionTreeClassifier,
+    DecisionTreeRegressor,
+    ExtraTreeClassifier,
+    ExtraTreeRegressor,
+)
+
+# Compiled tree models
+# Every tree of a model is flattened into shared node arrays, so a prediction
+# is a few vectorized steps over all rows and trees instead of a call through
+# sklearn's input validation. Leaves point to themselves, which lets every
+# walk take the same number of steps, the depth of the deepest tree
+
+COMPILED_MODEL_NAME = "model"
+
+TREES = (
+    DecisionTreeClassifier,
+    DecisionTreeRegressor,
+    ExtraTreeClassifier,
+    ExtraTreeRegressor,
+)
+# Ensembles that average their trees
+FORESTS = (
+    RandomForestClassifier,
+    RandomForestRegressor,
+    ExtraTreesClassifier,
+    ExtraTreesRegressor,
+)
+
+
+def supports(estimator):
+    return isinstance(estimator, TREES + FORESTS) and estimator.n_outputs_ == 1
+
+
+def _tree_nodes(tree, offset, probabilities):
+    nodes = np.arange(tree.node_count)
+    leaf = tree.children_left == -1
+
+    value = tree.value[:, 0, :].astype(np.float64)
+    if probabilities:
+        # As DecisionTreeClassifier.predict_proba normalizes them
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        value = value / normalizer
+
+    # Trees fitted before sklearn handled missing values send NaN right
+    missing_left = getattr(tree, "missing_go_to_left", None)
+    if missing_left is None:
+        missing_left = np.zeros(tree.node_count, dtype=bool)
+
+    return {
+        "feature": np.where(leaf, 0, tree.feature),
+        "threshold": np.where(leaf, 0.0, tree.threshold),
+        "left": np.where(leaf, nodes, tree.children_left) + offset,
+        "right": np.where(leaf, nodes, tree.children_right) + offset,
+        "missing_left": np.asarray(missing_left, dtype=bool) & ~leaf,
+        "value": value,
+    }
+
+
+class CompiledTrees:
+    arrays = [
+        "feature",
+        "threshold",
+        "left",
+        "right",
+        "missing_left",
+        "value",
+        "roots",
+    ]
+
+    @classmethod
+    def from_estimator(cls, estimator, source=None):
+        if not supports(estimator):
+            raise ValueError(f"Can't compile {type(estimator).__name__}")
+
+        forest = isinstance(estimator, FORESTS)
+        classifier = hasattr(estimator, "classes_")
+        trees = (
+            [e.tree_ for e in estimator.estimators_] if forest else [estimator.tree_]
+        )
+
+        parts, roots, offset = [], [], 0
+        for tree in trees:
+            parts.append(_tree_nodes(tree, offset, classifier and forest))
+            roots.append(offset)
+            offset += tree.node_count
+
+        compiled = cls.__new__(cls)
+        for attr in cls.arrays[:-1]:
+            setattr(compiled, attr, np.concatenate([p[attr] for p in parts]))
+        compiled.feature = compiled.feature.astype(np.intp)
+        compiled.left = compiled.left.astype(np.intp)
+        compiled.right = compiled.right.astype(np.intp)
+        compiled.roots = np.array(roots, dtype=np.intp)
+        compiled.classes = estimator.classes_ if classifier else None
+        compiled.depth = max(tree.max_depth for tree in trees)
+        compiled.estimator = type(estimator).__name__
+        compiled.source = source
+        compiled._prepare()
+        return compiled
+
+    def _prepare(self):
+        self.averaged = len(self.roots) > 1
+        self._has_missing = bool(self.missing_left.any())
+        # Right and left child of node i at 2i and 2i + 1, so a step is one
+        # lookup of 2 * node + go_left
+        self._children = np.empty(2 * self.n_nodes, dtype=np.intp)
+        self._children[0::2] = self.right
+        self._children[1::2] = self.left
+        # Single trees walk one row in plain Python, which is cheaper than any
+        # array operation at that size
+        self._nodes = None
+        if not self.averaged:
+            self._nodes = list(
+                zip(
+                    self.feature.tolist(),
+                    self.threshold.tolist(),
+                    self.left.tolist(),
+                    self.right.tolist(),
+                    self.missing_left.tolist(),
+                )
+            )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    def apply(self, X):
+        # Trees compare float32 features to their float64 thresholds, like
+        # sklearn does after casting its input
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        rows, width = X.shape
+        offsets = (np.arange(rows, dtype=np.intp) * width)[:, np.newaxis]
+        values = X.ravel()
+
+        # Every step reuses the same buffers: the feature of each node, its
+        # value in the row, the threshold, and then the child it moves to
+        nodes = np.tile(self.roots, (rows, 1))
+        cells = np.empty_like(nodes)
+        row_values = np.empty(nodes.shape, dtype=np.float32)
+        thresholds = np.empty(nodes.shape)
+        go_left = np.empty(nodes.shape, dtype=bool)
+        for _ in range(self.depth):
+            np.take(self.feature, nodes, out=cells)
+            cells += offsets
+            np.take(values, cells, out=row_values)
+            np.take(self.threshold, nodes, out=thresholds)
+            np.less_equal(row_values, thresholds, out=go_left)
+            if self._has_missing:
+                go_left |= np.isnan(row_values) & np.take(self.missing_left, nodes)
+            nodes *= 2
+            nodes += go_left
+            np.take(self._children, nodes, out=nodes)
+        return nodes
+
+    def _walk(self, row):
+        node = 0
+        nodes = self._nodes
+        for _ in range(self.depth):
+            feature, threshold, left, right, missing_left = nodes[node]
+            value = row[feature]
+            if value <= threshold or (missing_left and value != value):
+                node = left
+            else:
+                node = right
+        return node
+
+    def _raw(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2:
+            raise ValueError("X must be a 2D array of feature rows")
+        if not self.averaged:
+            if len(X) == 1:
+                return self.value[[self._walk(X[0].tolist())]]
+            return self.value[self.apply(X)[:, 0]]
+
+        # Summed tree by tree, in the order the forest adds them up
+        leaves = self.apply(X)
+        total = np.zeros((len(X), self.value.shape[1]))
+        for tree in range(self.n_trees):
+            total += self.value[leaves[:, tree]]
+        total /= self.n_trees
+        return total
+
+    def predict_proba(self, X):
+        if self.classes is None:
+            raise ValueError("predict_proba needs a classifier")
+        proba = self._raw(X)
+        if not self.averaged:
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            proba = proba / normalizer
+        return proba
+
+    def predict(self, X):
+        raw = self._raw(X)
+        if self.classes is None:
+            return raw[:, 0]
+        return self.classes.take(np.argmax(raw, axis=1), axis=0)
+
+    def save(self, store_dir, name=COMPILED_MODEL_NAME):
+        os.makedirs(store_dir, exist_ok=True)
+        for attr in self.arrays:
+            np.save(f"{store_dir}/{name}.{attr}.npy", getattr(self, attr))
+        if self.classes is not None:
+            np.save(f"{store_dir}/{name}.classes.npy", self.classes)
+        with open(f"{store_dir}/{name}.json", "w") as f:
+            json.dump(
+                {
+                    "estimator": self.estimator,
+                    "depth": self.depth,
+                    "classifier": self.classes is not None,
+                    "source": self.source,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, store_dir, name=COMPILED_MODEL_NAME):
+        # Memory-mapped read-only like the feature store, so worker processes
+        # share the node arrays
+        compiled = cls.__new__(cls)
+        for attr in cls.arrays:
+            array = np.load(f"{store_dir}/{name}.{attr}.npy", mmap_mode="r")
+            setattr(compiled, attr, array)
+        with open(f"{store_dir}/{name}.json") as f:
+            meta = json.load(f)
+        compiled.classes = None
+        if meta["classifier"]:
+            compiled.classes = np.load(f"{store_dir}/{name}.classes.npy")
+        compiled.depth = meta["depth"]
+        compiled.estimator = meta["estimator"]
+        compiled.source = meta["source"]
+        compiled._prepare()
+        return compiled
+
+
+def model_version(model_dir):
+    with open(model_dir, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def export_model(model_dir, store_dir):
+    compiled = CompiledTrees.from_estimator(
+        joblib.load(model_dir), source=model_version(model_dir)
+    )
+    compiled.save(store_dir)
+    return compiled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile the /match model into the node arrays it is served from"
+    )
+    parser.add_argument("--model", default="./models/nba_sklearn_model_extended.pkl")
+    parser.add_argument("--out", default="./models/compiled")
+    args = parser.parse_args()
+
+    compiled = export_model(args.model, args.out)
+    print(
+        f" * {compiled.estimator}: {compiled.n_trees} trees, {compiled.n_nodes} nodes"
+    )
+    print(f" * Saved compiled model to {args.out}")
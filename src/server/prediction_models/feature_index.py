@@ -0,0 +1,178 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Index rows are sorted by a composite (team, date) key so that every lookup,
+# single game or batch, is a vectorized binary search
+_DATE_BITS = 32
+_DATE_OFFSET = 2**31
+_DATE_MASK = (1 << _DATE_BITS) - 1
+NO_DAY = np.iinfo(np.int64).min
+
+
+def to_days(dates):
+    dates = pd.to_datetime(pd.Series(np.asarray(dates)))
+    return dates.values.astype("datetime64[D]").astype(np.int64)
+
+
+def _team_keys(codes, days):
+    return (codes.astype(np.int64) << _DATE_BITS) + (days + _DATE_OFFSET)
+
+
+class _StoredIndex:
+    arrays = []
+
+    def save(self, store_dir, name, source=None):
+        os.makedirs(store_dir, exist_ok=True)
+        np.save(f"{store_dir}/{name}.teams.npy", self.teams.values)
+        for attr in self.arrays:
+            np.save(f"{store_dir}/{name}.{attr}.npy", getattr(self, attr))
+        with open(f"{store_dir}/{name}.json", "w") as f:
+            json.dump({"columns": self.columns, "source": source}, f)
+
+    @classmethod
+    def load(cls, store_dir, name):
+        # Arrays stay on disk, memory-mapped read-only, so every process
+        # loading the same store shares the page cache
+        index = cls.__new__(cls)
+        index.teams = pd.Index(np.load(f"{store_dir}/{name}.teams.npy"))
+        for attr in cls.arrays:
+            array = np.load(f"{store_dir}/{name}.{attr}.npy", mmap_mode="r")
+            setattr(index, attr, array)
+        with open(f"{store_dir}/{name}.json") as f:
+            meta = json.load(f)
+        index.columns = meta["columns"]
+        index.source = meta.get("source")
+        return index
+
+    def last_days(self, team_ids):
+        # Date of each team's latest row, or the smallest day for teams the
+        # index doesn't have
+        codes = self.teams.get_indexer(np.asarray(team_ids))
+        known = codes >= 0
+        codes = np.where(known, codes, 0).astype(np.int64)
+        first = np.searchsorted(self.keys, _team_keys(codes, -_DATE_OFFSET))
+        end = np.searchsorted(self.keys, _team_keys(codes + 1, -_DATE_OFFSET))
+        known &= end > first
+        if not known.any():
+            return np.full(len(codes), NO_DAY)
+        days = (self.keys[np.maximum(end - 1, 0)] & _DATE_MASK) - _DATE_OFFSET
+        return np.where(known, days, NO_DAY)
+
+
+class TeamGamesIndex(_StoredIndex):
+    arrays = ["keys", "sums", "counts"]
+
+    def __init__(self, games, features):
+        self.columns = ["WIN_PRCT"] + list(features)
+
+        home = games["TEAM_ID_home"].values
+        away = games["TEAM_ID_away"].values
+        home_wins = games["HOME_TEAM_WINS"].values
+
+        # One row per (team, game), interleaved so that ties keep the CSV order
+        team_ids = np.column_stack([home, away]).ravel()
+        days = np.repeat(to_days(games["GAME_DATE_EST"].values), 2)
+        values = np.empty((len(team_ids), len(self.columns)))
+        values[:, 0] = np.column_stack([home_wins == 1, home_wins == 0]).ravel()
+        for i, col in enumerate(features, start=1):
+            values[:, i] = np.column_stack(
+                [games["%s_home" % col].values, games["%s_away" % col].values]
+            ).ravel()
+
+        self.teams = pd.Index(np.unique(team_ids))
+        keys = _team_keys(self.teams.get_indexer(team_ids), days)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        values = values[order]
+
+        # NaN stats are skipped, like DataFrame.mean does
+        valid = ~np.isnan(values)
+        self.sums = np.zeros((len(values) + 1, len(self.columns)))
+        self.counts = np.zeros((len(values) + 1, len(self.columns)), dtype=np.int64)
+        np.cumsum(np.where(valid, values, 0.0), axis=0, out=self.sums[1:])
+        np.cumsum(valid, axis=0, out=self.counts[1:])
+
+    def window_sums(self, team_ids, dates, n):
+        codes = self.teams.get_indexer(np.asarray(team_ids))
+        known = codes >= 0
+        codes = np.where(known, codes, 0)
+
+        first = np.searchsorted(self.keys, _team_keys(codes, -_DATE_OFFSET))
+        end = np.searchsorted(self.keys, _team_keys(codes, to_days(dates)))
+        end = np.where(known, end, first)
+        start = np.maximum(end - n, first)
+
+        sums = self.sums[end] - self.sums[start]
+        counts = self.counts[end] - self.counts[start]
+        return sums, counts
+
+    def window_mean(self, team_ids, dates, n):
+        sums, counts = self.window_sums(team_ids, dates, n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+
+class TeamRankingsIndex(_StoredIndex):
+    arrays = ["keys", "seasons", "values", "prev_rows"]
+
+    def __init__(self, rankings, features):
+        self.columns = [col for col in features if col != "TEAM_ID"]
+
+        team_ids = rankings["TEAM_ID"].values
+        seasons = rankings["SEASON_ID"].values.astype(np.int64)
+        self.teams = pd.Index(np.unique(team_ids))
+        codes = self.teams.get_indexer(team_ids)
+        keys = _team_keys(codes, to_days(rankings["STANDINGSDATE"].values))
+
+        order = np.lexsort((seasons, keys))
+        self.keys = keys[order]
+        self.seasons = seasons[order]
+        self.values = rankings[self.columns].values.astype(float)[order]
+        codes = codes[order]
+
+        # For every row, the last row of an earlier season than the newest one
+        # the team has played up to that row
+        rows = np.arange(len(codes))
+        team_start = np.searchsorted(codes, codes)
+        season_keys = (codes.astype(np.int64) << _DATE_BITS) + self.seasons
+        max_season_keys = np.maximum.accumulate(season_keys)
+        new_season = np.ones(len(codes), dtype=bool)
+        new_season[1:] = max_season_keys[1:] > max_season_keys[:-1]
+
+        prev_rows = np.where(season_keys < max_season_keys, rows, -1)
+        prev_rows = np.where(new_season & (rows > team_start), rows - 1, prev_rows)
+        prev_rows = np.maximum.accumulate(prev_rows)
+        self.prev_rows = np.where(prev_rows >= team_start, prev_rows, -1)
+
+    def lookup(self, team_ids, dates):
+        codes = self.teams.get_indexer(np.asarray(team_ids))
+        known = codes >= 0
+        codes = np.where(known, codes, 0)
+
+        first = np.searchsorted(self.keys, _team_keys(codes, -_DATE_OFFSET))
+        end = np.searchsorted(self.keys, _team_keys(codes, to_days(dates)))
+        current = np.maximum(end - 1, 0)
+        prev = self.prev_rows[current]
+        found = known & (end > first) & (prev >= 0)
+
+        values = np.hstack([self.values[current], self.values[prev]])
+        values[~found] = np.nan
+        return values, found
+
+    def final_state(self, team_id):
+        # Latest standings, previous-season standings and newest season of a
+        # team, i.e. what lookup returns for any date after its last standings
+        code = self.teams.get_indexer([team_id])[0]
+        if code < 0:
+            return None
+        first = np.searchsorted(self.keys, _team_keys(np.int64(code), -_DATE_OFFSET))
+        end = np.searchsorted(self.keys, _team_keys(np.int64(code + 1), -_DATE_OFFSET))
+        prev = self.prev_rows[end - 1]
+        return (
+            self.values[end - 1],
+            self.values[prev] if prev >= 0 else None,
+            self.seasons[first:end].max(),
+        )
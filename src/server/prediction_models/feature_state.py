@@ -0,0 +1,284 @@
+import copy
+import threading
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from .feature_index import to_days
+from .prepare_data import game_features
+
+# Live feature state
+# Games and standings added while the server runs are kept per team on top of
+# the startup snapshot (feature store or CSVs). Adding one is O(1), and views
+# over a snapshot index answer the same queries as the index itself, so
+# get_vector_data reads them without rebuilding anything. Records dated on or
+# before a team's last snapshot row are already in the snapshot, e.g. when
+# populate_database.py or a replayed feed posts them again, and are ignored
+
+
+class _TeamGames:
+    def __init__(self):
+        self.days = []
+        self.rows = []
+        self.game_ids = set()
+
+    def add(self, game_id, day, values, valid):
+        # A game posted twice counts once
+        if game_id is not None:
+            if game_id in self.game_ids:
+                return
+            self.game_ids.add(game_id)
+
+        # Late games are put back in date order, after games of the same day
+        position = bisect_right(self.days, day)
+        self.days.insert(position, day)
+        self.rows.insert(position, (values, valid))
+
+    def window(self, day, n, after):
+        start = bisect_right(self.days, after)
+        end = bisect_left(self.days, day)
+        return self.rows[max(end - n, start) : end]
+
+
+class TeamGamesState:
+    def __init__(self):
+        self._teams = {}
+        self._lock = threading.Lock()
+
+    def add_game(self, team_id, date, values, game_id=None):
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        day = to_days([date])[0]
+        with self._lock:
+            team = self._teams.get(str(team_id))
+            if team is None:
+                team = self._teams[str(team_id)] = _TeamGames()
+            team.add(game_id, day, np.where(valid, values, 0.0), valid)
+
+    def copy(self):
+        # A state of its own for a forked worker, with a lock nobody holds
+        state = TeamGamesState()
+        with self._lock:
+            state._teams = copy.deepcopy(self._teams)
+        return state
+
+    # Copies are sent to prediction workers, without the lock
+    def __getstate__(self):
+        return {"teams": self._teams}
+
+    def __setstate__(self, state):
+        self._teams = state["teams"]
+        self._lock = threading.Lock()
+
+    def view(self, index):
+        return _GamesView(index, self)
+
+    def window_mean(self, index, team_ids, dates, n):
+        if not self._teams:
+            return index.window_mean(team_ids, dates, n)
+
+        team_ids = np.asarray(team_ids)
+        days = to_days(dates)
+        snapshot_days = index.last_days(team_ids)
+        live = np.zeros(len(team_ids), dtype=np.int64)
+        sums = np.zeros((len(team_ids), len(index.columns)))
+        counts = np.zeros((len(team_ids), len(index.columns)), dtype=np.int64)
+        with self._lock:
+            for i, (team_id, day) in enumerate(zip(team_ids, days)):
+                team = self._teams.get(str(team_id))
+                rows = None
+                if team is not None:
+                    rows = team.window(day, n, after=snapshot_days[i])
+                if rows:
+                    live[i] = len(rows)
+                    sums[i] = np.sum([row[0] for row in rows], axis=0)
+                    counts[i] = np.sum([row[1] for row in rows], axis=0)
+
+        # The rest of each window comes from the snapshot, which only holds
+        # games older than the live ones
+        snapshot_sums, snapshot_counts = index.window_sums(team_ids, dates, n - live)
+        sums += snapshot_sums
+        counts += snapshot_counts
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+
+class _GamesView:
+    def __init__(self, index, state):
+        self.index = index
+        self.state = state
+        self.columns = index.columns
+
+    def window_mean(self, team_ids, dates, n):
+        return self.state.window_mean(self.index, team_ids, dates, n)
+
+
+class _TeamRankings:
+    def __init__(self):
+        self.row_days = []
+        self.rows = []
+        self.days = []
+        self.states = []
+
+    def add(self, day, season, values):
+        # ranking.csv lists standings newest first, so late rows are common:
+        # they go in date order, and only the states after them are refolded
+        position = bisect_right(self.row_days, day)
+        self.row_days.insert(position, day)
+        self.rows.insert(position, (day, season, values))
+        del self.days[position:]
+        del self.states[position:]
+
+    def fold(self, seed, after):
+        # Same rules as TeamRankingsIndex.prev_rows: the previous-season
+        # standings are the last ones of a season older than the newest seen
+        if self.states:
+            current, prev, max_season = self.states[-1]
+        elif seed is not None:
+            current, prev, max_season = seed
+        else:
+            current, prev, max_season = None, None, None
+
+        for day, season, values in self.rows[len(self.states) :]:
+            # Rows the snapshot already has keep the state as it is
+            if day > after:
+                if max_season is None:
+                    max_season = season
+                elif season > max_season:
+                    prev = current
+                    max_season = season
+                elif season < max_season:
+                    prev = values
+                current = values
+            self.days.append(day)
+            self.states.append((current, prev, max_season))
+
+    def at(self, day):
+        position = bisect_left(self.days, day)
+        return self.states[position - 1] if position else None
+
+
+class TeamRankingsState:
+    def __init__(self):
+        self._teams = {}
+        self._lock = threading.Lock()
+
+    def add_ranking(self, team_id, date, season, values):
+        day = to_days([date])[0]
+        values = np.asarray(values, dtype=float)
+        with self._lock:
+            team = self._teams.get(str(team_id))
+            if team is None:
+                team = self._teams[str(team_id)] = _TeamRankings()
+            team.add(day, int(season), values)
+
+    def copy(self):
+        state = TeamRankingsState()
+        with self._lock:
+            state._teams = copy.deepcopy(self._teams)
+        return state
+
+    def __getstate__(self):
+        return {"teams": self._teams}
+
+    def __setstate__(self, state):
+        self._teams = state["teams"]
+        self._lock = threading.Lock()
+
+    def view(self, index):
+        return _RankingsView(index, self)
+
+    def lookup(self, index, team_ids, dates):
+        values, found = index.lookup(team_ids, dates)
+        if not self._teams:
+            return values, found
+
+        days = to_days(dates)
+        snapshot_days = index.last_days(team_ids)
+        width = len(index.columns)
+        with self._lock:
+            for i, (team_id, day) in enumerate(zip(np.asarray(team_ids), days)):
+                team = self._teams.get(str(team_id))
+                # Up to its last date the snapshot already has the answer
+                if team is None or day <= snapshot_days[i]:
+                    continue
+                if len(team.states) < len(team.rows):
+                    team.fold(
+                        index.final_state(_index_team_id(index, team_id)),
+                        after=snapshot_days[i],
+                    )
+
+                state = team.at(day)
+                if state is None:
+                    continue
+                current, prev, _ = state
+                found[i] = prev is not None
+                values[i, :width] = current if found[i] else np.nan
+                values[i, width:] = prev if found[i] else np.nan
+        return values, found
+
+
+class _RankingsView:
+    def __init__(self, index, state):
+        self.index = index
+        self.state = state
+        self.columns = index.columns
+
+    def lookup(self, team_ids, dates):
+        return self.state.lookup(self.index, team_ids, dates)
+
+
+def _index_team_id(index, team_id):
+    # Snapshot team ids are parsed from the CSVs, live ones come as strings
+    try:
+        return index.teams.dtype.type(team_id)
+    except (TypeError, ValueError):
+        return team_id
+
+
+# Records as stored in the database, converted like the notebook that builds
+# formated_games.csv and formated_rankings.csv. Records with missing values
+# are skipped, as they are dropped from those CSVs
+
+
+def team_game_values(game):
+    if game.get("game_date_est") is None:
+        return []
+    home_wins = _number(game.get("home_team_wins"))
+    rows = []
+    for side, won in [("home", home_wins == 1), ("away", home_wins == 0)]:
+        values = [float(won)] + [
+            _number(game.get(f"{col.lower()}_{side}")) for col in game_features
+        ]
+        rows.append((game.get(f"{side}_team_id"), values))
+
+    if np.isnan(home_wins) or any(np.isnan(rows[0][1] + rows[1][1])):
+        return []
+    return rows
+
+
+def ranking_values(ranking):
+    values = [
+        _number(ranking.get("w_pct")),
+        _record_pct(ranking.get("home_record")),
+        _record_pct(ranking.get("road_record")),
+    ]
+    if ranking.get("standingsdate") is None or any(np.isnan(values)):
+        return None
+    # SEASON_ID is "<season type><year>", e.g. 22018
+    return int(str(ranking.get("season_id"))[1:5]), values
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _record_pct(record):
+    try:
+        won, lost = [int(x) for x in str(record).split("-")]
+    except ValueError:
+        return np.nan
+    return won / (won + lost) if won + lost else np.nan
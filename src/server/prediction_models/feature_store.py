@@ -0,0 +1,71 @@
+import argparse
+import hashlib
+import os
+
+import pandas as pd
+
+from .feature_index import TeamGamesIndex, TeamRankingsIndex
+from .prepare_data import game_features, ranking_features
+
+GAMES_INDEX_NAME = "games"
+RANKINGS_INDEX_NAME = "rankings"
+
+
+def csv_version(csv_dir):
+    with open(csv_dir, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def build_feature_store(games_dir, rankings_dir, store_dir):
+    games_index = TeamGamesIndex(pd.read_csv(games_dir), game_features)
+    games_index.save(store_dir, GAMES_INDEX_NAME, source=csv_version(games_dir))
+
+    rankings_index = TeamRankingsIndex(pd.read_csv(rankings_dir), ranking_features)
+    rankings_index.save(
+        store_dir, RANKINGS_INDEX_NAME, source=csv_version(rankings_dir)
+    )
+
+    return games_index, rankings_index
+
+
+def load_stored_index(index_class, store_dir, name, csv_dir):
+    # Every index records the CSV it was built from, so a store left behind by
+    # older CSVs is never served. None when there is no current index
+    if not os.path.exists(f"{store_dir}/{name}.json"):
+        return None
+    index = index_class.load(store_dir, name)
+    if index.source != csv_version(csv_dir):
+        print(f" * Feature store {name} index is out of date with {csv_dir}")
+        return None
+    return index
+
+
+def load_feature_store(store_dir, games_dir, rankings_dir):
+    games_index = load_stored_index(
+        TeamGamesIndex, store_dir, GAMES_INDEX_NAME, games_dir
+    )
+    rankings_index = load_stored_index(
+        TeamRankingsIndex, store_dir, RANKINGS_INDEX_NAME, rankings_dir
+    )
+    if games_index is None or rankings_index is None:
+        return build_feature_store(games_dir, rankings_dir, store_dir)
+    return games_index, rankings_index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the memory-mapped feature store used by /match"
+    )
+    parser.add_argument("--games", default="./data/model_dataset/formated_games.csv")
+    parser.add_argument(
+        "--rankings", default="./data/model_dataset/formated_rankings.csv"
+    )
+    parser.add_argument("--out", default="./data/model_dataset/feature_store")
+    args = parser.parse_args()
+
+    games_index, rankings_index = build_feature_store(
+        args.games, args.rankings, args.out
+    )
+    print(f" * Games index: {len(games_index.keys)} team games")
+    print(f" * Rankings index: {len(rankings_index.keys)} standings")
+    print(f" * Saved feature store to {args.out}")
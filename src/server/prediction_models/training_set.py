@@ -0,0 +1,81 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from .feature_index import TeamGamesIndex, TeamRankingsIndex
+from .prepare_data import game_features, get_vector_data, ranking_features
+
+# Set in every worker process: the full games table and both indexes, built
+# once in the parent and inherited through fork
+_worker_data = {}
+
+
+def _init_worker(all_games, games_index, rankings_index):
+    _worker_data["all_games"] = all_games
+    _worker_data["games_index"] = games_index
+    _worker_data["rankings_index"] = rankings_index
+
+
+def _season_vectors(season):
+    all_games = _worker_data["all_games"]
+    return get_vector_data(
+        games=all_games.loc[all_games["SEASON"] == season],
+        all_games=all_games,
+        all_rankings=None,
+        prediction=False,
+        games_index=_worker_data["games_index"],
+        rankings_index=_worker_data["rankings_index"],
+    )
+
+
+def build_training_set(games_dir, rankings_dir, out, workers=None):
+    # The indexes sort every team's games and standings once; each game's
+    # features are then windows over the rows strictly before its date, so
+    # no game sees its own result
+    all_games = pd.read_csv(games_dir)
+    games_index = TeamGamesIndex(all_games, game_features)
+    rankings_index = TeamRankingsIndex(pd.read_csv(rankings_dir), ranking_features)
+    seasons = sorted(all_games["SEASON"].unique())
+
+    if os.path.exists(out):
+        os.remove(out)
+
+    total = 0
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+        initargs=(all_games, games_index, rankings_index),
+    ) as executor:
+        # Seasons are written in order as they finish, one chunk each
+        for season, vectors in zip(seasons, executor.map(_season_vectors, seasons)):
+            vectors.to_csv(out, mode="a", header=season == seasons[0], index=False)
+            total += len(vectors)
+            print(f" * Season {season}: {len(vectors)} games")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the training dataset of every historical game"
+    )
+    parser.add_argument("--games", default="./data/model_dataset/formated_games.csv")
+    parser.add_argument(
+        "--rankings", default="./data/model_dataset/formated_rankings.csv"
+    )
+    parser.add_argument(
+        "--out", default="./data/model_dataset/extended_games_formated.csv"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes building seasons in parallel (default: one per core)",
+    )
+    args = parser.parse_args()
+
+    total = build_training_set(args.games, args.rankings, args.out, args.workers)
+    print(f" * Saved {total} games to {args.out}")
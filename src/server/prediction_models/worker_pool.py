@@ -0,0 +1,215 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class PoolBusy(Exception):
+    pass
+
+
+class WorkerDied(Exception):
+    pass
+
+
+class WorkerFailed(RuntimeError):
+    pass
+
+
+def _worker_loop(function, update, restore, state, tasks, results, heartbeats, slot):
+    # Other threads of the parent may have held any lock at the fork, so the
+    # worker swaps in the copy of the state taken for it before forking
+    if restore is not None:
+        restore(state)
+
+    while True:
+        heartbeats[slot] = time.time()
+        try:
+            task = tasks.get(timeout=1)
+        except queue.Empty:
+            continue
+        if task is None:
+            return
+
+        task_id, args = task
+        if task_id is None:
+            # Broadcast updates have no caller waiting for them
+            try:
+                update(*args)
+            except Exception:
+                pass
+            continue
+        try:
+            results.put((slot, task_id, True, function(*args)))
+        except Exception as error:
+            results.put((slot, task_id, False, repr(error)))
+
+
+class PredictionWorkerPool:
+    def __init__(
+        self,
+        function,
+        update=None,
+        processes=None,
+        max_pending=256,
+        health_timeout=30,
+        snapshot=None,
+        restore=None,
+    ):
+        # snapshot() runs in the parent before every fork, and restore(state)
+        # in the new worker with what it returned
+        self.function = function
+        self.update = update
+        self.snapshot = snapshot
+        self.restore = restore
+        self.processes = processes or os.cpu_count()
+        self.max_pending = max_pending
+        self.health_timeout = health_timeout
+        self.restarts = 0
+
+        # Workers are forked, not spawned, so the model and feature arrays
+        # loaded by the parent are shared copy-on-write instead of reloaded
+        self._context = multiprocessing.get_context("fork")
+        self._results = self._context.Queue()
+        self._heartbeats = self._context.Array("d", self.processes, lock=False)
+        self._workers = [None] * self.processes
+        self._tasks = [None] * self.processes
+        self._pending = [{} for _ in range(self.processes)]
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for slot in range(self.processes):
+            self._replace(slot)
+
+        for target, name in [(self._collect, "results"), (self._monitor, "monitor")]:
+            thread = threading.Thread(
+                target=target, name=f"prediction-pool-{name}", daemon=True
+            )
+            thread.start()
+
+    def submit(self, *args, timeout=None):
+        # Backpressure: callers wait at most `timeout` for one of the
+        # max_pending slots instead of queueing without bound
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolBusy(f"{self.max_pending} predictions already pending")
+
+        future = Future()
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            slot = min(range(self.processes), key=lambda s: len(self._pending[s]))
+            task_id = self._next_id
+            self._next_id += 1
+            self._pending[slot][task_id] = future
+            self._tasks[slot].put((task_id, args))
+        return future
+
+    def broadcast(self, *args):
+        # Sent through the task queues, so every worker applies the update
+        # before any prediction submitted after it
+        with self._lock:
+            for tasks in self._tasks:
+                if tasks is not None:
+                    tasks.put((None, args))
+
+    def run(self, *args, timeout=None):
+        return self.submit(*args, timeout=timeout).result()
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            workers = [
+                {
+                    "pid": worker.pid,
+                    "alive": worker.is_alive(),
+                    "pending": len(pending),
+                    "heartbeat_age": round(now - heartbeat, 3),
+                }
+                for worker, pending, heartbeat in zip(
+                    self._workers, self._pending, self._heartbeats
+                )
+                if worker is not None
+            ]
+        return {
+            "processes": self.processes,
+            "max_pending": self.max_pending,
+            "restarts": self.restarts,
+            "workers": workers,
+        }
+
+    def _replace(self, slot):
+        # The new task queue is installed first: updates broadcast before it
+        # are already in the parent's state when it is copied, the ones after
+        # it wait in the queue
+        tasks = self._context.Queue()
+        with self._lock:
+            pending = self._pending[slot]
+            self._pending[slot] = {}
+            self._tasks[slot] = tasks
+        state = self.snapshot() if self.snapshot is not None else None
+
+        # Forked without holding the pool lock, which the child can't release
+        self._heartbeats[slot] = time.time()
+        worker = self._context.Process(
+            target=_worker_loop,
+            args=(
+                self.function,
+                self.update,
+                self.restore,
+                state,
+                tasks,
+                self._results,
+                self._heartbeats,
+                slot,
+            ),
+            name=f"prediction-worker-{slot}",
+            daemon=True,
+        )
+        worker.start()
+        with self._lock:
+            self._workers[slot] = worker
+        return pending
+
+    def _collect(self):
+        while True:
+            slot, task_id, ok, payload = self._results.get()
+            with self._lock:
+                future = self._pending[slot].pop(task_id, None)
+            # Results of a worker that was already replaced are dropped
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(WorkerFailed(payload))
+
+    def _monitor(self):
+        while True:
+            time.sleep(1)
+            now = time.time()
+            for slot in range(self.processes):
+                worker = self._workers[slot]
+                # Workers beat between tasks, so a stale heartbeat means a
+                # worker stuck on one task for longer than health_timeout
+                stale = now - self._heartbeats[slot] > self.health_timeout
+                if worker.is_alive() and not stale:
+                    continue
+
+                if worker.is_alive():
+                    worker.kill()
+                worker.join()
+                pending = self._replace(slot)
+                with self._lock:
+                    self.restarts += 1
+                for future in pending.values():
+                    future.set_exception(
+                        WorkerDied(f"prediction worker {slot} was restarted")
+                    )
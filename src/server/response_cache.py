@@ -0,0 +1,120 @@
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, make_response, request
+
+from . import serialization
+from .database import repository
+
+# Conditional responses
+# A read response only depends on the request and on the rows of the tables
+# it reads, so its ETag is a hash of both: the request and the version of every
+# table. Clients sending it back in If-None-Match get a 304 while no write has
+# touched those tables, and the full response is served from memory until then
+
+
+class ResponseCache:
+    def __init__(self, maxsize=1000, max_entry_bytes=1 << 20):
+        self.maxsize = maxsize
+        self.max_entry_bytes = max_entry_bytes
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(etag)
+            self.hits += 1
+            return entry
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def put(self, etag, body, headers):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._entries[etag] = (body, headers)
+            self._entries.move_to_end(etag)
+            # Entries of older versions are never asked for again and age out
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "max_entry_bytes": self.max_entry_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+            }
+
+
+def _etag(tables):
+    # Responses differ by negotiated format, not by the Accept header itself
+    mimetype = serialization.columns_format() or serialization.JSON
+    key = repr(
+        (
+            request.path,
+            request.query_string,
+            request.get_data(),
+            mimetype,
+            tuple(tables),
+            repository.table_versions(tables),
+        )
+    )
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def versioned(cache, tables):
+    # tables: the tables the view reads, or a function of the view arguments
+    # returning them
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            names = tables(**kwargs) if callable(tables) else tables
+            etag = _etag(names)
+
+            if request.if_none_match.contains(etag):
+                cache.count_not_modified()
+                response = Response(status=304)
+                response.set_etag(etag)
+                response.vary.add("Accept")
+                return response
+
+            entry = cache.get(etag)
+            if entry is not None:
+                body, headers = entry
+                return Response(body, headers=headers)
+
+            response = make_response(view(**kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(etag)
+            response.vary.add("Accept")
+            # Streamed responses are sent as they are read, so only their
+            # ETag is kept
+            if not response.is_streamed:
+                cache.put(etag, response.get_data(), list(response.headers))
+            return response
+
+        return wrapper
+
+    return decorator
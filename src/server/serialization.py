@@ -0,0 +1,89 @@
+import json
+from decimal import Decimal
+from itertools import islice
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Column-tuple responses
+# Rows go from the cursor tuples to the response as they are: column names
+# once, then one array of native values per row. Clients ask for them through
+# the Accept header; plain application/json keeps each endpoint's usual shape
+
+JSON = "application/json"
+COLUMNS_JSON = "application/vnd.nba.columns+json"
+MSGPACK = "application/msgpack"
+
+# Rows encoded per call, so the encoder isn't called once per row
+CHUNK_ROWS = 1000
+
+
+def _native(value):
+    # Dates and times as str() writes them, like the plain JSON responses
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+if orjson is not None:
+
+    def _dumps(value):
+        return orjson.dumps(
+            value, default=_native, option=orjson.OPT_PASSTHROUGH_DATETIME
+        ).decode()
+
+else:
+
+    def _dumps(value):
+        return json.dumps(value, default=_native, separators=(",", ":"))
+
+
+def _chunks(rows):
+    rows = iter(rows)
+    while True:
+        chunk = [tuple(row) for row in islice(rows, CHUNK_ROWS)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_columns_json(columns, rows):
+    yield '{"columns":' + _dumps(list(columns)) + ',"rows":['
+    for index, chunk in enumerate(_chunks(rows)):
+        yield ("," if index else "") + _dumps(chunk)[1:-1]
+    yield "]}"
+
+
+def encode_msgpack(columns, rows):
+    # A stream of msgpack objects: the column names, then one array per row,
+    # read back with msgpack.Unpacker
+    packer = msgpack.Packer(default=_native)
+    yield packer.pack(list(columns))
+    for chunk in _chunks(rows):
+        yield b"".join(packer.pack(row) for row in chunk)
+
+
+ENCODERS = {COLUMNS_JSON: encode_columns_json}
+if msgpack is not None:
+    ENCODERS[MSGPACK] = encode_msgpack
+
+
+def columns_format():
+    # None unless the client prefers one of the column-tuple formats
+    best = request.accept_mimetypes.best_match([JSON] + list(ENCODERS), default=JSON)
+    return best if best in ENCODERS else None
+
+
+def columns_response(mimetype, columns, rows, headers=None):
+    return Response(
+        ENCODERS[mimetype](columns, rows), mimetype=mimetype, headers=headers
+    )
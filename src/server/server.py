@@ -1,30 +1,303 @@
 import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from itertools import groupby
 
 import joblib
+import numpy as np
 import pandas as pd
-from flask import request
+from flask import Response, request, stream_with_context
 from sklearn.tree import DecisionTreeClassifier
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.sql import text
 
-from . import create_app
+from . import create_app, metrics, serialization
 from .database import repository
 from .database.models import *
-from .prediction_models.prepare_data import get_vector_data
+from .database.pool import POOL_STATS
+from .lazy import LazyResource
+from .metrics import SamplingProfiler, span
+from .prediction_models.batcher import MicroBatcher
+from .prediction_models.compiled_trees import (
+    COMPILED_MODEL_NAME,
+    CompiledTrees,
+    model_version,
+    supports,
+)
+from .prediction_models.cache import PredictionCache
+from .prediction_models.feature_index import (
+    NO_DAY,
+    TeamGamesIndex,
+    TeamRankingsIndex,
+)
+from .prediction_models.feature_state import (
+    TeamGamesState,
+    TeamRankingsState,
+    ranking_values,
+    team_game_values,
+)
+from .prediction_models.feature_store import (
+    GAMES_INDEX_NAME,
+    RANKINGS_INDEX_NAME,
+    load_stored_index,
+)
+from .prediction_models.prepare_data import (
+    game_features,
+    get_vector_data,
+    get_vector_data_batch,
+    ranking_features,
+)
+from .prediction_models.worker_pool import (
+    PoolBusy,
+    PredictionWorkerPool,
+    WorkerDied,
+    WorkerFailed,
+)
+from .response_cache import ResponseCache, versioned
 
 # INSTANCIATE FLASK APP
 
 app = create_app()
-engine = db.get_engine(app=app)
 
-# LOAD PREDICTION MODEL
+# PREDICTION MODEL AND DATASETS
+# Loaded on first use, so CRUD-only workers never pay for them. Prediction
+# workers can preload everything through /admin/warmup (or PRELOAD_PREDICTION)
+# before they are marked ready
 
 MODEL_DIR = "./models/nba_sklearn_model_extended.pkl"
-model_clf = joblib.load(MODEL_DIR)
-print(f" * Prediction Model: {type(model_clf)}")
+GAMES_DIR = "./data/model_dataset/formated_games.csv"
+RANKINGS_DIR = "./data/model_dataset/formated_rankings.csv"
+FEATURE_STORE_DIR = "./data/model_dataset/feature_store"
+COMPILED_MODEL_DIR = "./models/compiled"
+
+# Tree models are served from their compiled node arrays unless
+# PREDICTION_COMPILED_MODEL=0. An exported copy is only used while it was
+# compiled from the current model file
+COMPILED_MODEL = os.environ.get("PREDICTION_COMPILED_MODEL", "1") != "0"
+
+
+def _load_model():
+    if COMPILED_MODEL and os.path.exists(
+        f"{COMPILED_MODEL_DIR}/{COMPILED_MODEL_NAME}.json"
+    ):
+        compiled = CompiledTrees.load(COMPILED_MODEL_DIR)
+        if compiled.source == MODEL_VERSION.get():
+            print(f" * Prediction Model: compiled {compiled.estimator}")
+            return compiled
+
+    model = joblib.load(MODEL_DIR)
+    print(f" * Prediction Model: {type(model)}")
+    if COMPILED_MODEL and supports(model):
+        model = CompiledTrees.from_estimator(model, source=MODEL_VERSION.get())
+        print(f" * Compiled to {model.n_trees} trees, {model.n_nodes} nodes")
+    return model
+
+
+def _load_model_version():
+    return model_version(MODEL_DIR)
+
+
+def _load_games_index():
+    # The feature store already holds every feature /match needs, so the CSVs
+    # are only parsed when no store built from the current CSVs is available
+    games_index = load_stored_index(
+        TeamGamesIndex, FEATURE_STORE_DIR, GAMES_INDEX_NAME, GAMES_DIR
+    )
+    if games_index is None:
+        games_index = TeamGamesIndex(ALL_GAMES.get(), game_features)
+    print(f" * Games index ({len(games_index.keys)} team games)")
+    return games_index
+
+
+def _load_rankings_index():
+    rankings_index = load_stored_index(
+        TeamRankingsIndex, FEATURE_STORE_DIR, RANKINGS_INDEX_NAME, RANKINGS_DIR
+    )
+    if rankings_index is None:
+        rankings_index = TeamRankingsIndex(ALL_RANKINGS.get(), ranking_features)
+    print(f" * Rankings index ({len(rankings_index.keys)} standings)")
+    return rankings_index
+
+
+model_clf = LazyResource("model", _load_model)
+MODEL_VERSION = LazyResource("model_version", _load_model_version)
+ALL_GAMES = LazyResource("games", lambda: pd.read_csv(GAMES_DIR))
+ALL_RANKINGS = LazyResource("rankings", lambda: pd.read_csv(RANKINGS_DIR))
+GAMES_INDEX = LazyResource("games_index", _load_games_index)
+RANKINGS_INDEX = LazyResource("rankings_index", _load_rankings_index)
+
+PREDICTION_RESOURCES = [model_clf, MODEL_VERSION, GAMES_INDEX, RANKINGS_INDEX]
+
+# Games and standings in the database after the snapshot, read on top of the
+# indexes so predictions use them without a restart. Every server process
+# rebuilds them from the database once the game or ranking table versions
+# change, so writes through any process reach all of them
+GAMES_STATE = TeamGamesState()
+RANKINGS_STATE = TeamRankingsState()
+FEATURE_TABLES = [Game.__tablename__, Ranking.__tablename__]
+FEATURE_VERSIONS = None
+_feature_states_lock = threading.Lock()
+
+
+def games_index():
+    return GAMES_STATE.view(GAMES_INDEX.get())
+
+
+def rankings_index():
+    return RANKINGS_STATE.view(RANKINGS_INDEX.get())
+
+
+def _snapshot_end(index):
+    # Rows up to every team's last snapshot day are already in the index
+    days = index.last_days(index.teams.values)
+    days = days[days != NO_DAY]
+    if not len(days):
+        return None
+    return np.datetime64(int(days.min()), "D").astype(datetime)
+
+
+def _load_feature_states():
+    games_state, rankings_state = TeamGamesState(), TeamRankingsState()
+
+    games = repository.rows_after(
+        Game, "game_date_est", _snapshot_end(GAMES_INDEX.get())
+    )
+    for record in games:
+        for team_id, values in team_game_values(record):
+            games_state.add_game(
+                team_id, record["game_date_est"], values, game_id=record["id"]
+            )
+
+    rankings = repository.rows_after(
+        Ranking, "standingsdate", _snapshot_end(RANKINGS_INDEX.get())
+    )
+    for record in rankings:
+        ranking = ranking_values(record)
+        if ranking is not None:
+            season, values = ranking
+            rankings_state.add_ranking(
+                record["team_id"], record["standingsdate"], season, values
+            )
+    return games_state, rankings_state
+
+
+def sync_feature_states():
+    # Versions are read before the rows, so a write committed in between only
+    # makes the next call rebuild again
+    global FEATURE_VERSIONS
+    versions = repository.table_versions(FEATURE_TABLES)
+    if versions == FEATURE_VERSIONS:
+        return versions
+
+    with _feature_states_lock:
+        if versions != FEATURE_VERSIONS:
+            with span("features.sync"):
+                states = _load_feature_states()
+            if PREDICTION_POOL is not None:
+                PREDICTION_POOL.broadcast(tuple(state.copy() for state in states))
+            _restore_feature_states(states)
+            FEATURE_VERSIONS = versions
+    return versions
+
+
+def _copy_feature_states():
+    return GAMES_STATE.copy(), RANKINGS_STATE.copy()
+
+
+def _restore_feature_states(states):
+    global GAMES_STATE, RANKINGS_STATE
+    GAMES_STATE, RANKINGS_STATE = states
 
-ALL_GAMES = pd.read_csv("./data/model_dataset/formated_games.csv")
-ALL_RANKINGS = pd.read_csv("./data/model_dataset/formated_rankings.csv")
-print(f" * Loaded dataset (games and rankings)")
+
+PREDICTION_CACHE = PredictionCache(
+    maxsize=int(os.environ.get("PREDICTION_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("PREDICTION_CACHE_TTL", 3600)),
+)
+
+
+def score_games(games):
+    df = get_vector_data_batch(
+        games, games_index=games_index(), rankings_index=rankings_index()
+    )
+
+    # Games without enough history for every feature can't be scored
+    values = df.values
+    complete = ~np.isnan(values).any(axis=1)
+    predictions = np.full(len(df), None, dtype=object)
+    if complete.any():
+        with span("model.predict"):
+            predictions[complete] = model_clf.get().predict(values[complete]).tolist()
+    return predictions.tolist()
+
+
+def predict_games(games):
+    if PREDICTION_POOL is not None:
+        with span("prediction.workers"):
+            return PREDICTION_POOL.run(games, timeout=PREDICTION_QUEUE_TIMEOUT)
+    return score_games(games)
+
+
+def _predict_single_games(games):
+    games = pd.DataFrame(
+        games, columns=["GAME_DATE_EST", "TEAM_ID_home", "TEAM_ID_away"]
+    )
+    return predict_games(games)
+
+
+# Concurrent single-game /match requests are coalesced into micro-batches that
+# share one feature build and one predict call
+PREDICTION_BATCHER = None
+if os.environ.get("PREDICTION_BATCHING"):
+    PREDICTION_BATCHER = MicroBatcher(
+        _predict_single_games,
+        max_batch_size=int(os.environ.get("PREDICTION_BATCH_SIZE", 64)),
+        max_wait_ms=float(os.environ.get("PREDICTION_BATCH_WAIT_MS", 5)),
+        concurrency=int(os.environ.get("PREDICTION_WORKERS", 1)),
+    )
+
+
+def warmup():
+    timings = {}
+    for resource in PREDICTION_RESOURCES:
+        start = time.perf_counter()
+        resource.get()
+        timings[resource.name] = round(time.perf_counter() - start, 6)
+    return timings
+
+
+if os.environ.get("PRELOAD_PREDICTION"):
+    warmup()
+
+# Only workers set up to serve /match wait for its resources to be ready
+SERVE_PREDICTIONS = bool(
+    os.environ.get("PRELOAD_PREDICTION") or os.environ.get("PREDICTION_WORKERS")
+)
+
+# Scoring runs in forked worker processes so /match can use every core. The
+# model and feature arrays are loaded before forking and shared copy-on-write
+PREDICTION_POOL = None
+PREDICTION_QUEUE_TIMEOUT = float(os.environ.get("PREDICTION_QUEUE_TIMEOUT", 5))
+if os.environ.get("PREDICTION_WORKERS"):
+    warmup()
+    PREDICTION_POOL = PredictionWorkerPool(
+        score_games,
+        update=_restore_feature_states,
+        processes=int(os.environ["PREDICTION_WORKERS"]),
+        max_pending=int(os.environ.get("PREDICTION_MAX_PENDING", 256)),
+        health_timeout=float(os.environ.get("PREDICTION_WORKER_TIMEOUT", 30)),
+        snapshot=_copy_feature_states,
+        restore=_restore_feature_states,
+    )
+    PREDICTION_POOL.start()
+
+# Read endpoints answer If-None-Match with a 304 and keep their latest
+# responses, for as long as the tables they read are unchanged
+RESPONSE_CACHE = ResponseCache(
+    maxsize=int(os.environ.get("RESPONSE_CACHE_SIZE", 1000)),
+    max_entry_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRY_BYTES", 1 << 20)),
+)
 
 # ENDPOINTS
 
@@ -35,68 +308,199 @@ def index():
 
 
 @app.route("/players/week/<date>", methods=["GET"])
+@versioned(RESPONSE_CACHE, [Game.__tablename__, GameDetail.__tablename__])
 def week_best_players(date: str):
     data = request.get_json()
     limit = 1
     if data:
         limit = data.get("limit", 1)
 
-    with engine.connect() as con:
-        statement = text(
-            """
+    try:
+        day = datetime.strptime(date[:10], "%Y-%m-%d")
+    except ValueError:
+        return json.dumps("date must be YYYY-MM-DD"), 400
+
+    # Same weeks as YEARWEEK (Sunday to Saturday), as a range on the indexed date
+    week_start = day - timedelta(days=(day.weekday() + 1) % 7)
+    week_end = week_start + timedelta(days=7)
+
+    statement = text(
+        """
             SELECT game_detail.player_name,game_detail.reb ,game_detail.ast ,  game_detail.pts ,game_detail.reb + game_detail.ast  +  game_detail.pts as total_stats, game.game_date_est 
             FROM game_detail, game
             WHERE
                 game_detail.game_id = game.id
                 AND
-                YEARWEEK(:date) = YEARWEEK(game.game_date_est)
+                game.game_date_est >= :week_start
+                AND
+                game.game_date_est < :week_end
             ORDER BY total_stats DESC
             LIMIT  :limit;
             """
-        )
+    )
 
-        rs = con.execute(statement, **{"date": date, "limit": limit})
+    columns, rows = repository.fetch_rows(
+        statement, **{"week_start": week_start, "week_end": week_end, "limit": limit}
+    )
+    mimetype = serialization.columns_format()
+    if mimetype is not None:
+        return serialization.columns_response(mimetype, columns, rows)
+
+    players = [{k: str(v) for k, v in zip(columns, row)} for row in rows]
 
-    return json.dumps([{k: str(v) for k, v in dict(r).items()} for r in rs]), 200
+    return json.dumps(players), 200
 
 
 @app.route("/players/season/<year>", methods=["GET"])
+@versioned(RESPONSE_CACHE, [WeeklyPlayerTotal.__tablename__])
 def season_best_player(year: str):
     data = request.get_json()
     limit = 1
     if data:
         limit = data.get("limit", 1)
 
-    result = []
-    with engine.connect() as con:
-        for week in range(1, 54):
-
-            statement = text(
-                """
-                SELECT game_detail.player_name,game_detail.reb ,game_detail.ast ,  game_detail.pts ,game_detail.reb + game_detail.ast  +  game_detail.pts as total_stats, game.game_date_est 
-                FROM game_detail, game
-                WHERE
-                    game_detail.game_id = game.id
-                    AND
-                    :yearweek = YEARWEEK(game.game_date_est)
+    if not year.isdigit():
+        return json.dumps("year must be a number"), 400
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit <= 0:
+        return json.dumps("limit must be a positive integer"), 400
+
+    statement = text(
+        """
+            SELECT DISTINCT yearweek
+            FROM weekly_player_totals
+            WHERE yearweek BETWEEN :first_week AND :last_week
+            ORDER BY yearweek;
+            """
+    )
+    _, yearweeks = repository.fetch_rows(
+        statement,
+        **{"first_week": int(year) * 100 + 1, "last_week": int(year) * 100 + 53},
+    )
+
+    # The best players of every week, each read from the top of its
+    # (yearweek, total_stats) index range
+    columns = [
+        "yearweek",
+        "player_name",
+        "reb",
+        "ast",
+        "pts",
+        "total_stats",
+        "game_date_est",
+    ]
+    selected = ", ".join(columns)
+    weeks_top = " UNION ALL ".join(
+        f"""
+            SELECT * FROM (
+                SELECT {selected}
+                FROM weekly_player_totals
+                WHERE yearweek = :week_{i}
                 ORDER BY total_stats DESC
-                LIMIT  :limit;
-                """
-            )
+                LIMIT :limit
+            ) AS week_{i}
+            """
+        for i in range(len(yearweeks))
+    )
+    rows = []
+    if yearweeks:
+        _, rows = repository.fetch_rows(
+            text(f"{weeks_top} ORDER BY yearweek, total_stats DESC;"),
+            limit=limit,
+            **{f"week_{i}": yearweek for i, (yearweek,) in enumerate(yearweeks)},
+        )
+    weeks = groupby(rows, key=lambda r: r[0])
+
+    # One row per player, with the week in place of yearweek
+    mimetype = serialization.columns_format()
+    if mimetype is not None:
+        rows = (
+            (yearweek % 100, *row[1:])
+            for yearweek, week_rows in weeks
+            for row in week_rows
+        )
+        return serialization.columns_response(mimetype, ["week"] + columns[1:], rows)
 
-            rs = con.execute(statement, **{"yearweek": f"{year}{week}", "limit": limit})
-            players = [{k: str(v) for k, v in dict(r).items()} for r in rs]
-            if players:
-                result.append({"week": week, "best_players": players})
+    result = []
+    for yearweek, week_rows in weeks:
+        players = [
+            {k: str(v) for k, v in zip(columns[1:], row[1:])} for row in week_rows
+        ]
+        result.append({"week": yearweek % 100, "best_players": players})
 
     return json.dumps(result), 200
 
 
+def _json_array(records):
+    yield "["
+    for index, record in enumerate(records):
+        yield ("," if index else "") + json.dumps(record, default=str)
+    yield "]"
+
+
+def _ndjson(records):
+    for record in records:
+        yield json.dumps(record, default=str) + "\n"
+
+
 @app.route("/<entity>", methods=["GET"])
+@versioned(RESPONSE_CACHE, lambda entity: [ENTITY_MAPPER[entity].__tablename__])
 def fetch_all(entity):
-    records = repository.get_all(ENTITY_MAPPER[entity])
-    all_records = [rec.to_json() for rec in records]
-    return json.dumps(all_records), 200
+    model = ENTITY_MAPPER[entity]
+    keys = [column.name for column in model.__table__.primary_key.columns]
+
+    after = request.args.get("after")
+    if after is not None:
+        after = after.split(",")
+        if len(after) != len(keys):
+            return json.dumps(f"after must be {','.join(keys)}"), 400
+    limit = request.args.get("limit")
+    if limit is not None:
+        limit = int(limit) if limit.isdigit() else 0
+        if limit <= 0:
+            return json.dumps("limit must be a positive integer"), 400
+
+    try:
+        names, rows = repository.iter_rows(
+            model, model.json_columns, after=after, limit=limit
+        )
+    except (TypeError, ValueError):
+        return json.dumps(f"after must be {','.join(keys)}"), 400
+    columns = model.json_columns
+    positions = [names.index(k) for k in columns]
+
+    def _values(row):
+        return tuple(row[p] for p in positions)
+
+    ndjson = request.args.get("format") == "ndjson"
+    mimetype = None if ndjson else serialization.columns_format()
+
+    if ndjson or limit is None:
+        # The request stays open while the rows are sent, so they are read
+        # through its session and counted against its endpoint
+        rows = stream_with_context(rows)
+        if mimetype is not None:
+            values = (_values(row) for row in rows)
+            return serialization.columns_response(mimetype, columns, values)
+        records = (dict(zip(columns, _values(row))) for row in rows)
+        if ndjson:
+            return Response(_ndjson(records), mimetype="application/x-ndjson")
+        return Response(_json_array(records), mimetype="application/json")
+
+    # Pages are bounded, so they are built in memory to know the next key
+    page = []
+    last = None
+    for row in rows:
+        page.append(_values(row))
+        last = row
+
+    headers = {}
+    if last is not None and len(page) == limit:
+        # iter_rows selects the key columns first
+        headers["X-Next-After"] = ",".join(str(v) for v in last[: len(keys)])
+    if mimetype is not None:
+        return serialization.columns_response(mimetype, columns, page, headers)
+    records = [dict(zip(columns, values)) for values in page]
+    return json.dumps(records, default=str), 200, headers
 
 
 @app.route("/add/<entity>", methods=["POST"])
@@ -105,9 +509,24 @@ def add(entity):
     if not data:
         json.dumps("None is not valid as input"), 400
     repository.insert(ENTITY_MAPPER[entity], **data)
+    _records_added(entity, [data])
     return json.dumps("Added"), 200
 
 
+def _records_added(entity, records):
+    # Cached predictions involving these teams are stale. Their keys have
+    # older table versions too, this only frees them right away
+    if entity == "games":
+        columns = ["home_team_id", "away_team_id"]
+    elif entity == "rankings":
+        columns = ["team_id"]
+    else:
+        return
+    PREDICTION_CACHE.invalidate_teams(
+        {str(record.get(column)) for record in records for column in columns}
+    )
+
+
 @app.route("/remove/<entity>/<record_id>", methods=["DELETE"])
 def remove(entity, record_id):
     repository.delete(ENTITY_MAPPER[entity], id=record_id)
@@ -121,13 +540,257 @@ def edit(entity, record_id):
     return json.dumps("Edited"), 200
 
 
+# BULK CHANGES
+# Each request is applied in a single transaction and answers one status per
+# record, in request order. Constraint violations roll back the whole request
+
+
+def _bulk_change(change, entity, records):
+    if not isinstance(records, list) or not records:
+        return None, (json.dumps("A non-empty list of records is required"), 400)
+    try:
+        with repository.session_scope():
+            statuses = change(ENTITY_MAPPER[entity], records)
+    except IntegrityError as error:
+        return None, (json.dumps({"error": str(error.orig)}), 409)
+    return statuses, (json.dumps(statuses), 200)
+
+
+@app.route("/add/<entity>/bulk", methods=["POST"])
+def add_bulk(entity):
+    records = request.get_json()
+    statuses, response = _bulk_change(repository.bulk_insert, entity, records)
+    if statuses is not None:
+        added = [r for r, s in zip(records, statuses) if s["status"] == "added"]
+        _records_added(entity, added)
+    return response
+
+
+@app.route("/edit/<entity>/bulk", methods=["PATCH"])
+def edit_bulk(entity):
+    _, response = _bulk_change(repository.bulk_edit, entity, request.get_json())
+    return response
+
+
+@app.route("/remove/<entity>/bulk", methods=["DELETE"])
+def remove_bulk(entity):
+    _, response = _bulk_change(repository.bulk_delete, entity, request.get_json())
+    return response
+
+
+def _single_game(data):
+    values = [data.get(k) for k in ["GAME_DATE_EST", "TEAM_ID_home", "TEAM_ID_away"]]
+    values = [v[0] if isinstance(v, list) and len(v) == 1 else v for v in values]
+    if any(v is None or isinstance(v, list) for v in values):
+        return None
+    return tuple(values)
+
+
+def _prediction_key(game, versions):
+    # The game and ranking versions change with writes through any server
+    # process, so entries cached before them are never read again
+    return (MODEL_VERSION.get(), *versions, *[str(v) for v in game])
+
+
 @app.route("/match", methods=["POST"])
 def match():
     data = request.get_json()
+    versions = sync_feature_states()
+
+    game = _single_game(data)
+    key = _prediction_key(game, versions) if game is not None else None
+    if key is not None:
+        prediction = PREDICTION_CACHE.get(key)
+        if prediction is not None:
+            return json.dumps({"HOME_TEAM_WINS_PREDICTION": prediction}), 200
+
+    if key is not None and (PREDICTION_BATCHER or PREDICTION_POOL) is not None:
+        if PREDICTION_BATCHER is not None:
+            with span("prediction.batcher"):
+                prediction = PREDICTION_BATCHER.predict(game)
+        else:
+            prediction = _predict_single_games([game])[0]
+        if prediction is None:
+            return json.dumps("Not enough history to predict this game"), 400
+        PREDICTION_CACHE.put(key, prediction, teams=key[-2:])
+        return json.dumps({"HOME_TEAM_WINS_PREDICTION": prediction}), 200
+
     df = get_vector_data(
-        games=data, all_games=ALL_GAMES, all_rankings=ALL_RANKINGS, prediction=True
+        games=data,
+        all_games=None,
+        all_rankings=None,
+        prediction=True,
+        games_index=games_index(),
+        rankings_index=rankings_index(),
     )
-    df = df.drop("GAME_ID", axis=1)
-    prediction = model_clf.predict(df.values)
-    return json.dumps({"HOME_TEAM_WINS_PREDICTION": prediction.item()}), 200
+    values = df.drop("GAME_ID", axis=1).values.astype(float)
+    # Same answer as score_games gives the batched and worker modes
+    if np.isnan(values).any():
+        return json.dumps("Not enough history to predict this game"), 400
+    with span("model.predict"):
+        prediction = model_clf.get().predict(values).item()
+
+    if key is not None:
+        PREDICTION_CACHE.put(key, prediction, teams=key[-2:])
+    return json.dumps({"HOME_TEAM_WINS_PREDICTION": prediction}), 200
+
+
+@app.route("/match/cache", methods=["GET"])
+def match_cache():
+    return json.dumps(PREDICTION_CACHE.stats()), 200
+
+
+@app.route("/match/batching", methods=["GET"])
+def match_batching():
+    if PREDICTION_BATCHER is None:
+        return json.dumps({"enabled": False}), 200
+    return json.dumps({"enabled": True, **PREDICTION_BATCHER.stats()}), 200
+
+
+BATCH_COLUMNS = ["GAME_ID", "GAME_DATE_EST", "TEAM_ID_home", "TEAM_ID_away"]
+
+
+def _batch_games(data):
+    # A list of games, or every column as a list of the same length
+    if isinstance(data, list):
+        if not all(isinstance(game, dict) for game in data):
+            return None, "Games must be objects"
+    elif isinstance(data, dict):
+        lengths = {len(v) if isinstance(v, list) else None for v in data.values()}
+        if len(lengths) != 1 or None in lengths:
+            return None, "Columns must be lists of the same length"
+    else:
+        return None, "A list of games is required"
+
+    games = pd.DataFrame(data)
+    missing = [c for c in BATCH_COLUMNS if c not in games.columns]
+    if missing:
+        return None, f"Missing columns: {', '.join(missing)}"
+    required = games[BATCH_COLUMNS]
+    if required.isna().any().any():
+        return None, f"{', '.join(BATCH_COLUMNS)} are required for every game"
+    if any(isinstance(v, (list, dict)) for v in required.values.ravel()):
+        return None, f"{', '.join(BATCH_COLUMNS)} must be single values"
+    if pd.to_datetime(games["GAME_DATE_EST"], errors="coerce").isna().any():
+        return None, "GAME_DATE_EST must be a date"
+    return games, None
+
+
+@app.route("/match/batch", methods=["POST"])
+def match_batch():
+    data = request.get_json()
+    if not data:
+        return json.dumps("None is not valid as input"), 400
+
+    games, error = _batch_games(data)
+    if error is not None:
+        return json.dumps(error), 400
+    sync_feature_states()
+    predictions = predict_games(games)
+
+    mimetype = serialization.columns_format()
+    if mimetype is not None:
+        rows = zip(games["GAME_ID"].tolist(), predictions)
+        columns = ["GAME_ID", "HOME_TEAM_WINS_PREDICTION"]
+        return serialization.columns_response(mimetype, columns, rows)
+
+    result = [
+        {"GAME_ID": game_id, "HOME_TEAM_WINS_PREDICTION": prediction}
+        for game_id, prediction in zip(games["GAME_ID"].tolist(), predictions)
+    ]
+    return json.dumps(result), 200
+
+
+@app.route("/match/workers", methods=["GET"])
+def match_workers():
+    if PREDICTION_POOL is None:
+        return json.dumps({"enabled": False}), 200
+    return json.dumps({"enabled": True, **PREDICTION_POOL.stats()}), 200
+
+
+# Saturated, restarted or failed workers: the prediction can be retried
+@app.errorhandler(PoolBusy)
+@app.errorhandler(WorkerDied)
+@app.errorhandler(WorkerFailed)
+def prediction_pool_busy(error):
+    return json.dumps(str(error)), 503
+
+
+# ADMIN
+
+
+@app.route("/admin/warmup", methods=["POST"])
+def admin_warmup():
+    return json.dumps({"loaded": warmup()}), 200
+
+
+@app.route("/admin/pool", methods=["GET"])
+def admin_pool():
+    return json.dumps(POOL_STATS.snapshot(db.engine.pool)), 200
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    try:
+        db.session.execute(text("SELECT 1"))
+    except SQLAlchemyError:
+        return json.dumps({"ready": False, "database": "unreachable"}), 503
+
+    pending = []
+    if SERVE_PREDICTIONS:
+        pending = [r.name for r in PREDICTION_RESOURCES if not r.loaded]
+    if pending:
+        return json.dumps({"ready": False, "pending": pending}), 503
+    return json.dumps({"ready": True}), 200
+
+
+# METRICS
+# Latency histograms, in-flight requests, stage and database time in the
+# Prometheus text format. The sampling profiler is off unless SAMPLING_PROFILER
+# is set or it is switched on through /admin/profiler
+
+PROFILER = SamplingProfiler(
+    interval_ms=float(os.environ.get("SAMPLING_PROFILER_INTERVAL_MS", 10))
+)
+if os.environ.get("SAMPLING_PROFILER"):
+    PROFILER.start()
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    stats = {
+        "db_pool": POOL_STATS.snapshot(db.engine.pool),
+        "prediction_cache": PREDICTION_CACHE.stats(),
+        "response_cache": RESPONSE_CACHE.stats(),
+        "sampling_profiler": PROFILER.stats(),
+    }
+    if PREDICTION_BATCHER is not None:
+        stats["prediction_batcher"] = PREDICTION_BATCHER.stats()
+    if PREDICTION_POOL is not None:
+        stats["prediction_workers"] = PREDICTION_POOL.stats()
+    return Response(metrics.render(stats), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/admin/profiler", methods=["GET"])
+def admin_profiler():
+    return json.dumps(PROFILER.stats()), 200
+
+
+@app.route("/admin/profiler", methods=["POST"])
+def admin_profiler_toggle():
+    data = request.get_json() or {}
+    if not isinstance(data.get("enabled"), bool):
+        return json.dumps("enabled must be true or false"), 400
+
+    if data.get("reset"):
+        PROFILER.reset()
+    if data["enabled"]:
+        PROFILER.start(interval_ms=data.get("interval_ms"))
+    else:
+        PROFILER.stop()
+    return json.dumps(PROFILER.stats()), 200
+
 
+@app.route("/admin/profiler/stacks", methods=["GET"])
+def admin_profiler_stacks():
+    return Response(PROFILER.collapsed(), mimetype="text/plain")